@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+import logging
+import os
+import sys
+from pathlib import Path
+
+import click
+
+from catalog_index import hash_ids
+from fasta_stream import (
+    format_fasta,
+    gzip_member,
+    has_duplicate_hashes,
+    header_id,
+    ordered_pool_map,
+    read_fasta,
+)
+from filter_prodigal import filter_prodigal_records
+from gene_coords import GeneCoords, GeneCoordsBuilder, coords_path
+
+logger = logging.getLogger()
+
+
+def _read_input_list(input_list_fp):
+    with open(input_list_fp, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _build_sample_block(args):
+    """
+    Worker: filter the genes of one Prodigal output and return them as one gzip member.
+
+    Returns:
+    - tuple: (gzip member, uint64 hashes of the gene IDs, number of genes,
+      GeneCoords of the genes or None)
+    """
+    fasta_fp, sample_no, minlength, rename, compresslevel, with_coords = args
+    prefix = "S{0}C".format(sample_no).encode()
+    block = []
+    id_lst = []
+    coords = GeneCoordsBuilder() if with_coords else None
+    for header, seq in filter_prodigal_records(
+        read_fasta(fasta_fp), minlength=minlength, coords=coords
+    ):
+        if rename:
+            header = prefix + header
+        id_lst.append(header_id(header))
+        block.append(format_fasta(header, seq))
+    return (
+        gzip_member(b"".join(block), compresslevel),
+        hash_ids(id_lst),
+        len(id_lst),
+        coords.build() if with_coords else None,
+    )
+
+
+def build_gene_catalog(
+    fasta_fp_lst,
+    output_fp,
+    minlength=10,
+    rename=True,
+    threads=1,
+    compresslevel=1,
+    with_coords=True,
+):
+    """
+    Filter Prodigal gene calls of all samples and write them as one gzip gene catalog.
+
+    Samples are filtered in a process pool, each into its own gzip member, and the
+    members are written in input order, so the catalog does not depend on the number
+    of workers. Renaming follows vamb's concatenate_fasta: gene IDs of the n-th input
+    are prefixed with S<n>C. The gene coordinates are written next to the catalog
+    (<output_fp>.coords.npz, see gene_coords.py), in catalog order.
+
+    Parameters:
+    - fasta_fp_lst (list): Prodigal nucleotide FASTA files (plain or gzip), one per sample.
+    - output_fp (str): Path of the gzip compressed gene catalog.
+    - minlength (int): Genes shorter than this are skipped.
+    - rename (bool): Prefix the gene IDs with S<n>C.
+    - threads (int): Number of worker processes.
+    - compresslevel (int): gzip compression level.
+    - with_coords (bool): Write the gene coordinate table.
+
+    Returns:
+    - int: Number of genes in the catalog.
+    """
+    task_args = [
+        (fasta_fp, sample_no + 1, minlength, rename, compresslevel, with_coords)
+        for sample_no, fasta_fp in enumerate(fasta_fp_lst)
+    ]
+    hash_lst = []
+    coords_lst = []
+    n_genes = 0
+    with open(output_fp, "wb") as output:
+        for member, hashes, n_sample_genes, coords in ordered_pool_map(
+            _build_sample_block, task_args, threads, max_inflight=max(threads, 1) * 4
+        ):
+            output.write(member)
+            hash_lst.append(hashes)
+            if coords is not None:
+                coords_lst.append(coords)
+            n_genes += n_sample_genes
+
+    if has_duplicate_hashes(hash_lst):
+        os.remove(output_fp)
+        raise ValueError(
+            "Duplicated gene IDs (or ID hash collision) in the catalog, use renaming to make them unique."
+        )
+
+    if with_coords:
+        contig_prefix_lst = (
+            ["S{0}C".format(ii + 1) for ii in range(len(coords_lst))] if rename else None
+        )
+        GeneCoords.concatenate(coords_lst, contig_prefix_lst).save(coords_path(output_fp))
+    return n_genes
+
+
+@click.command(context_settings={"help_option_names": ["-h", "--help"]})
+@click.argument("output", type=click.Path())
+@click.argument("inputs", type=click.Path(exists=True), nargs=-1)
+@click.option(
+    "-l",
+    "--input-list",
+    type=click.Path(exists=True),
+    default=None,
+    help="File listing Prodigal FASTA files, one path per line (added after INPUTS).",
+)
+@click.option(
+    "-m",
+    "--minlength",
+    type=int,
+    default=10,
+    help="Discard genes below this length (default: 10).",
+)
+@click.option(
+    "--keepnames", is_flag=True, help="Do not rename genes with the S<n>C prefix."
+)
+@click.option(
+    "-t",
+    "--threads",
+    type=int,
+    default=1,
+    help="Number of worker processes filtering and compressing samples.",
+)
+@click.option(
+    "--compresslevel",
+    type=click.IntRange(1, 9),
+    default=1,
+    help="gzip compression level (default: 1).",
+)
+@click.option(
+    "--coords/--no-coords",
+    default=True,
+    help="Write the gene coordinates to OUTPUT.coords.npz (default: on).",
+)
+@click.option(
+    "--log-level",
+    default="INFO",
+    help="The desired log level (default INFO).",
+    type=click.Choice(
+        ["CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"], case_sensitive=False
+    ),
+)
+def main(
+    output,
+    inputs,
+    input_list,
+    minlength,
+    keepnames,
+    threads,
+    compresslevel,
+    coords,
+    log_level,
+):
+    """
+    Build the gene catalog from Prodigal gene calls: complete genes only, IDs as
+    contig::rel_pos::start::end::strand, stop markers removed.
+
+    OUTPUT: gzip compressed catalog. INPUTS: Prodigal nucleotide FASTA files, the
+    catalog keeps their order.
+    """
+    logging.basicConfig(level=log_level, format="[%(levelname)s] %(message)s")
+
+    fasta_fp_lst = list(inputs)
+    if input_list:
+        fasta_fp_lst.extend(_read_input_list(input_list))
+    if not fasta_fp_lst:
+        logger.error("No Prodigal FASTA files given.")
+        sys.exit(2)
+    if os.path.exists(output):
+        logger.error(f"The output file {output} already exists!")
+        sys.exit(2)
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        n_genes = build_gene_catalog(
+            fasta_fp_lst,
+            output,
+            minlength=minlength,
+            rename=not keepnames,
+            threads=threads,
+            compresslevel=compresslevel,
+            with_coords=coords,
+        )
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    logger.info(f"{n_genes} genes from {len(fasta_fp_lst)} samples written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Compact random-access index for gene catalog FASTA files.
+
+The index is a single numpy file next to the catalog (<catalog>.cidx.npy) holding one
+(hash, offset) pair per record, sorted by hash, and loaded memory-mapped:
+
+- hash: 64-bit BLAKE2b hash of the sequence ID (header up to the first whitespace)
+- offset: byte offset of the record header; for BGZF-compressed catalogs this is the
+  BGZF virtual offset, so the catalog can stay compressed on disk
+
+IDs are compared against the record header when fetching, so hash collisions are
+resolved instead of returning the wrong sequence.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+from fasta_stream import is_gzip
+
+INDEX_SUFFIX = ".cidx.npy"
+INDEX_DTYPE = np.dtype([("hash", "<u8"), ("offset", "<u8")])
+
+
+def hash_id(seq_id):
+    """Return the 64-bit hash of a sequence ID (str or bytes)."""
+    if isinstance(seq_id, str):
+        seq_id = seq_id.encode()
+    return int.from_bytes(hashlib.blake2b(seq_id, digest_size=8).digest(), "little")
+
+
+def hash_ids(seq_ids):
+    """Return the 64-bit hashes of many sequence IDs as a uint64 array."""
+    return np.fromiter((hash_id(it) for it in seq_ids), dtype=np.uint64)
+
+
+def index_path(fasta_path):
+    return str(fasta_path) + INDEX_SUFFIX
+
+
+def is_bgzf(fasta_path):
+    """Check the gzip header of the file for the BGZF extra field."""
+    with open(fasta_path, "rb") as f:
+        header = f.read(16)
+    return (
+        len(header) == 16
+        and header[:2] == b"\x1f\x8b"
+        and header[3] & 4  # FEXTRA
+        and header[12:14] == b"BC"
+    )
+
+
+def _open_catalog(fasta_path):
+    """Open the catalog for binary reads, returning a handle whose tell/seek use index offsets."""
+    if is_bgzf(fasta_path):
+        from Bio import bgzf
+
+        return bgzf.BgzfReader(fasta_path, "rb")
+    if is_gzip(fasta_path):
+        raise ValueError(
+            "{0} is gzip but not BGZF compressed, recompress it with bgzip to index it.".format(
+                fasta_path
+            )
+        )
+    return open(fasta_path, "rb")
+
+
+def _header_id(header_line):
+    return header_line[1:].split(maxsplit=1)[0]
+
+
+def build_catalog_index(fasta_path, output_path=None):
+    """
+    Scan the catalog once and write the sorted (hash, offset) index.
+
+    Parameters:
+    - fasta_path (str or Path): Plain or BGZF-compressed FASTA file.
+    - output_path (str): Index file, default: <fasta_path>.cidx.npy.
+
+    Returns:
+    - str: Path of the written index.
+    """
+    output_path = output_path or index_path(fasta_path)
+    hash_lst = []
+    offset_lst = []
+
+    bgzf_catalog = is_bgzf(fasta_path)
+    with _open_catalog(fasta_path) as f:
+        if bgzf_catalog:
+            # the BGZF virtual offset has to be asked for at every line
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                if line.startswith(b">"):
+                    hash_lst.append(hash_id(_header_id(line)))
+                    offset_lst.append(offset)
+        else:
+            offset = 0
+            for line in f:
+                if line.startswith(b">"):
+                    hash_lst.append(hash_id(_header_id(line)))
+                    offset_lst.append(offset)
+                offset += len(line)
+
+    index = np.empty(len(hash_lst), dtype=INDEX_DTYPE)
+    index["hash"] = hash_lst
+    index["offset"] = offset_lst
+    index = index[np.argsort(index["hash"], kind="stable")]
+
+    np.save(output_path, index)
+    return output_path
+
+
+class CatalogIndex:
+    """
+    Random access to the records of a gene catalog through its hashed offset index.
+
+    The index is built on first use and rebuilt when the catalog is newer than it.
+    """
+
+    def __init__(self, fasta_path, rebuild=False):
+        self.fasta_path = str(fasta_path)
+        self.index_path = index_path(fasta_path)
+        if (
+            rebuild
+            or not os.path.isfile(self.index_path)
+            or os.path.getmtime(self.index_path) < os.path.getmtime(self.fasta_path)
+        ):
+            build_catalog_index(self.fasta_path, self.index_path)
+        self.index = np.load(self.index_path, mmap_mode="r")
+        self.hashes = self.index["hash"]
+        self.offsets = self.index["offset"]
+        self.handle = _open_catalog(self.fasta_path)
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read_record(self, offset):
+        self.handle.seek(int(offset))
+        header = self.handle.readline()
+        seq_lst = []
+        while True:
+            line = self.handle.readline()
+            if not line or line.startswith(b">"):
+                break
+            seq_lst.append(line.strip())
+        return _header_id(header).decode(), b"".join(seq_lst).decode()
+
+    def fetch(self, seq_ids):
+        """
+        Fetch records by ID.
+
+        Parameters:
+        - seq_ids (iterable): Sequence IDs, duplicates are fetched once.
+
+        Returns:
+        - tuple: (records, missing) with records a list of (seq_id, sequence) in
+          catalog order and missing the IDs that are not in the catalog.
+        """
+        seq_ids = list(dict.fromkeys(seq_ids))
+        query_hashes = hash_ids(seq_ids)
+        left = np.searchsorted(self.hashes, query_hashes, side="left")
+        right = np.searchsorted(self.hashes, query_hashes, side="right")
+
+        # resolve candidates in offset order so the catalog is read front to back
+        candidates = []
+        for ii, (start, end) in enumerate(zip(left, right)):
+            for pos in range(start, end):
+                candidates.append((int(self.offsets[pos]), ii))
+        candidates.sort()
+
+        records = []
+        found = set()
+        for offset, ii in candidates:
+            if ii in found:
+                continue
+            record_id, seq = self._read_record(offset)
+            if record_id == seq_ids[ii]:
+                records.append((record_id, seq))
+                found.add(ii)
+
+        missing = [it for ii, it in enumerate(seq_ids) if ii not in found]
+        return records, missing
@@ -3,60 +3,184 @@
 import sys
 import os
 import argparse
-import gzip
-import vamb
+import re
 
-parser = argparse.ArgumentParser(
-    description="""Creates the input FASTA file for Vamb.
-Input should be one or more FASTA files, each from a sample-specific assembly.
-If keepnames is False, resulting FASTA can be binsplit with separator 'C'.""",
-    formatter_class=argparse.RawDescriptionHelpFormatter,
-    add_help=False,
+from catalog_index import hash_ids
+from fasta_stream import (
+    BGZF_EOF,
+    bgzf_compress,
+    format_fasta,
+    has_duplicate_hashes,
+    header_id,
+    ordered_pool_map,
+    read_fasta,
 )
 
-parser.add_argument("outpath", help="Path to output FASTA file")
-parser.add_argument("inpaths", help="Paths to input FASTA file(s)", nargs="+")
-parser.add_argument(
-    "-m",
-    dest="minlength",
-    metavar="",
-    type=int,
-    default=2000,
-    help="Discard sequences below this length [2000]",
-)
-parser.add_argument(
-    "--keepnames", action="store_true", help="Do not rename sequences [False]"
+# same checks as vamb's FastaEntry: identifiers must be valid SAM reference names and
+# sequences IUPAC DNA/RNA letters
+SAM_IDENTIFIER = re.compile(
+    rb"[0-9A-Za-z!#$%&+./:;?@^_|~-][0-9A-Za-z!#$%&*+./:;=?@^_|~-]*"
 )
-parser.add_argument("--nozip", action="store_true", help="Do not gzip output [False]")
+IUPAC_BYTES = b"acgtuswkmyrbdhvnACGTUSWKMYRBDHVN"
+
+
+def _concatenate_file(args):
+    """
+    Worker: read, filter and rename one FASTA file like vamb.vambtools.concatenate_fasta.
+
+    Returns:
+    - tuple: (records as FASTA bytes, BGZF compressed unless compresslevel is None;
+      uint64 hashes of the identifiers to check them across files, None when renaming;
+      number of kept sequences)
+    """
+    inpathno, inpath, minlength, rename, compresslevel = args
+    prefix = "S{0}C".format(inpathno + 1).encode()
+    identifiers = set()
+    block = []
+    try:
+        for header, seq in read_fasta(inpath):
+            if len(seq) < minlength:
+                continue
+            if rename:
+                header = prefix + header
+            identifier = header_id(header)
+            if not SAM_IDENTIFIER.fullmatch(identifier):
+                raise ValueError(
+                    "Identifier is not a valid SAM reference name: {0}".format(
+                        identifier.decode()
+                    )
+                )
+            masked = seq.translate(None, IUPAC_BYTES)
+            if masked:
+                raise ValueError(
+                    "Non-IUPAC DNA/RNA byte in sequence {0}: '{1}'".format(
+                        identifier.decode(), chr(masked[0])
+                    )
+                )
+            if identifier in identifiers:
+                raise ValueError(
+                    "Multiple sequences would be given identifier {0}.".format(
+                        identifier.decode()
+                    )
+                )
+            identifiers.add(identifier)
+            # vamb prints an empty line for an empty sequence
+            block.append(format_fasta(header, seq) if seq else b">" + header + b"\n\n")
+    except Exception as e:
+        print(f"Exception occured when parsing file {inpath}", file=sys.stderr)
+        raise e from None
+
+    data = b"".join(block)
+    if compresslevel is not None:
+        data = bgzf_compress(data, compresslevel)
+    # with renaming, the S<n>C prefix keeps identifiers of different files apart
+    hashes = None if rename else hash_ids(identifiers)
+    return data, hashes, len(identifiers)
 
-if len(sys.argv) == 1 or sys.argv[1] in ("-h", "--help"):
-    parser.print_help()
-    sys.exit()
 
-args = parser.parse_args()
+def concatenate_fasta(
+    outpath, inpaths, minlength=2000, rename=True, threads=1, compresslevel=1
+):
+    """
+    Write the sequences of all input files to one FASTA file, in input order.
 
-# Check inputs
-for path in args.inpaths:
-    if not os.path.isfile(path):
-        raise FileNotFoundError(path)
+    Files are parsed, filtered and BGZF-compressed in a process pool, at most a few
+    files per worker are held in memory at once. compresslevel None writes plain text.
+    """
+    task_args = [
+        (inpathno, inpath, minlength, rename, compresslevel)
+        for inpathno, inpath in enumerate(inpaths)
+    ]
+    hash_lst = []
+    n_sequences = 0
+    with open(outpath, "wb") as outfile:
+        for data, hashes, n_file_sequences in ordered_pool_map(
+            _concatenate_file, task_args, max(threads, 1)
+        ):
+            outfile.write(data)
+            if hashes is not None:
+                hash_lst.append(hashes)
+            n_sequences += n_file_sequences
+        if compresslevel is not None:
+            outfile.write(BGZF_EOF)
 
-if os.path.exists(args.outpath):
-    raise FileExistsError(args.outpath)
+    if has_duplicate_hashes(hash_lst):
+        os.remove(outpath)
+        raise ValueError(
+            "Multiple sequences would be given the same identifier (or ID hash collision), do not use --keepnames."
+        )
+    return n_sequences
 
-parent = os.path.dirname(args.outpath)
-if parent != "" and not os.path.isdir(parent):
-    raise NotADirectoryError(
-        f'Output file cannot be created: Parent directory "{parent}" is not an existing directory'
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""Creates the input FASTA file for Vamb.
+Input should be one or more FASTA files, each from a sample-specific assembly.
+If keepnames is False, resulting FASTA can be binsplit with separator 'C'.
+Input paths can also be listed in a file passed as @FILE, one per line.""",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        add_help=False,
+        fromfile_prefix_chars="@",
     )
 
-# Run the code. Compressing DNA is easy, this is not much bigger than level 9, but
-# many times faster
-filehandle = (
-    open(args.outpath, "w")
-    if args.nozip
-    else gzip.open(args.outpath, "wt", compresslevel=1)
-)
-vamb.vambtools.concatenate_fasta(
-    filehandle, args.inpaths, minlength=args.minlength, rename=(not args.keepnames)
-)
-filehandle.close()
+    parser.add_argument("outpath", help="Path to output FASTA file")
+    parser.add_argument("inpaths", help="Paths to input FASTA file(s)", nargs="+")
+    parser.add_argument(
+        "-m",
+        dest="minlength",
+        metavar="",
+        type=int,
+        default=2000,
+        help="Discard sequences below this length [2000]",
+    )
+    parser.add_argument(
+        "--keepnames", action="store_true", help="Do not rename sequences [False]"
+    )
+    parser.add_argument(
+        "--nozip", action="store_true", help="Do not compress output [False]"
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        dest="threads",
+        metavar="",
+        type=int,
+        default=1,
+        help="Worker processes reading and compressing input files [1]",
+    )
+
+    if len(sys.argv) == 1 or sys.argv[1] in ("-h", "--help"):
+        parser.print_help()
+        sys.exit()
+
+    args = parser.parse_args()
+
+    # Check inputs
+    for path in args.inpaths:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+
+    if os.path.exists(args.outpath):
+        raise FileExistsError(args.outpath)
+
+    parent = os.path.dirname(args.outpath)
+    if parent != "" and not os.path.isdir(parent):
+        raise NotADirectoryError(
+            f'Output file cannot be created: Parent directory "{parent}" is not an existing directory'
+        )
+
+    # Run the code. Output is BGZF, a gzip file of independent blocks: compressed in
+    # parallel and randomly accessible (see catalog_index.py). Compressing DNA is easy,
+    # level 1 is not much bigger than level 9, but many times faster
+    concatenate_fasta(
+        args.outpath,
+        args.inpaths,
+        minlength=args.minlength,
+        rename=not args.keepnames,
+        threads=args.threads,
+        compresslevel=None if args.nozip else 1,
+    )
+
+
+if __name__ == "__main__":
+    main()
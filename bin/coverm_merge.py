@@ -7,6 +7,8 @@ from pathlib import Path
 import click
 import pandas as pd
 
+from gene_matrix import save_gene_matrix
+
 # Configure logging
 title = Path(__file__).name
 logger = logging.getLogger(title)
@@ -22,7 +24,14 @@ logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
     default="merged_abundance.tsv",
     help="Output filename (TSV).",
 )
-def merge_abundance(files, output):
+@click.option(
+    "-b",
+    "--binary-output",
+    type=click.Path(),
+    default=None,
+    help="Also write a memory-mappable float32 matrix: PREFIX.npy with PREFIX.rows.txt and PREFIX.samples.txt.",
+)
+def merge_abundance(files, output, binary_output):
     """
     Merge CoverM contig abundance tables (count or rpkm) by concatenating sample columns from each batch file.
 
@@ -53,6 +62,14 @@ def merge_abundance(files, output):
         logger.error(f"Failed to write output: {e}")
         sys.exit(1)
 
+    if binary_output:
+        logger.info(f"Writing binary matrix to {binary_output}")
+        try:
+            save_gene_matrix(binary_output, merged)
+        except Exception as e:
+            logger.error(f"Failed to write binary output: {e}")
+            sys.exit(1)
+
     logger.info(f"Successfully merged {len(files)} files into '{output}'")
 
 
@@ -0,0 +1,235 @@
+"""
+Streaming FASTA reading and writing on raw bytes, shared by the bin/ helpers.
+
+Records are (header, sequence) pairs of bytes: the header without the leading '>'
+and the sequence without line breaks. Input is read in large blocks and split on
+record boundaries instead of building one object per record, which is what makes
+Biopython's SeqIO slow on catalogs of millions of genes.
+
+Plain, gzip (including BGZF), bzip2 and xz input are detected from the file content.
+Output ending in .gz is gzip compressed, with python-isal (isal.igzip) when it is
+installed and the standard gzip module otherwise. bgzf_compress writes BGZF blocks,
+which can be compressed in parallel and concatenated.
+
+ordered_pool_map runs the per-file or per-batch work of the helpers in a process
+pool and returns the results in input order, so outputs do not depend on the number
+of workers.
+"""
+
+import bz2
+import gzip
+import itertools
+import lzma
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    from isal import igzip as _gzip_backend
+    from isal import isal_zlib as _zlib_backend
+except ImportError:
+    _gzip_backend = gzip
+    _zlib_backend = zlib
+
+READ_BLOCK_SIZE = 1 << 22  # 4 MiB
+WRITE_BUFFER_SIZE = 1 << 22
+FASTA_LINE_WIDTH = 60  # same wrapping as Bio.SeqIO
+
+BGZF_BLOCK_SIZE = 0xFF00  # uncompressed bytes per BGZF block, as in htslib
+# empty block marking the end of a BGZF file
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def is_gzip(path):
+    with open(path, "rb") as f:
+        return f.read(2) == b"\x1f\x8b"
+
+
+def open_fasta(path):
+    """Open a plain, gzip/BGZF, bzip2 or xz FASTA file for binary reading."""
+    with open(path, "rb") as f:
+        magic = f.read(6)
+    if magic[:2] == b"\x1f\x8b":
+        return _gzip_backend.open(path, "rb")
+    if magic[:3] == b"BZh":
+        return bz2.open(path, "rb")
+    if magic == b"\xfd7zXZ\x00":
+        return lzma.open(path, "rb")
+    return open(path, "rb")
+
+
+def open_fasta_out(path, compresslevel=1):
+    """
+    Open a FASTA file for binary writing, gzip compressed if the path ends with .gz.
+
+    DNA compresses well already at level 1, higher levels are much slower for a few
+    percent smaller files.
+    """
+    if str(path).endswith(".gz"):
+        return _gzip_backend.open(path, "wb", compresslevel=compresslevel)
+    return open(path, "wb", buffering=WRITE_BUFFER_SIZE)
+
+
+def gzip_member(data, compresslevel=1):
+    """
+    Compress bytes into one gzip member. Concatenated members are a valid gzip file,
+    so blocks compressed in parallel can be written one after the other.
+    """
+    return _gzip_backend.compress(data, compresslevel=compresslevel)
+
+
+def bgzf_compress(data, compresslevel=1):
+    """
+    Compress bytes into BGZF blocks (without the EOF block).
+
+    Every block is a gzip member holding at most BGZF_BLOCK_SIZE bytes, so blocks
+    of consecutive chunks compressed by different workers can simply be written one
+    after the other; write BGZF_EOF once at the end of the file.
+    """
+    blocks = []
+    for start in range(0, len(data), BGZF_BLOCK_SIZE):
+        chunk = data[start : start + BGZF_BLOCK_SIZE]
+        compressor = _zlib_backend.compressobj(
+            compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS
+        )
+        deflated = compressor.compress(chunk) + compressor.flush()
+        # gzip header with the BC extra field holding the block size - 1
+        blocks.append(
+            struct.pack(
+                "<4BI2BH2BHH",
+                0x1F,
+                0x8B,
+                8,
+                4,
+                0,
+                0,
+                0xFF,
+                6,
+                ord("B"),
+                ord("C"),
+                2,
+                len(deflated) + 25,
+            )
+        )
+        blocks.append(deflated)
+        blocks.append(struct.pack("<II", zlib.crc32(chunk), len(chunk)))
+    return b"".join(blocks)
+
+
+def _split_record(record):
+    header, _, seq = record.partition(b"\n")
+    return header.rstrip(), seq.translate(None, b"\r\n ")
+
+
+def iter_fasta(handle, block_size=READ_BLOCK_SIZE):
+    """
+    Yield (header, sequence) of every record of a binary FASTA handle.
+
+    Lines before the first '>' are skipped, like Bio.SeqIO does.
+    """
+    pending = b""
+    started = False
+    while True:
+        block = handle.read(block_size)
+        if not block:
+            break
+        pending += block
+        if not started:
+            if pending.startswith(b">"):
+                pending = pending[1:]
+            else:
+                start = pending.find(b"\n>")
+                if start < 0:
+                    # keep the last line, it may be a header cut by the block end
+                    pending = pending[pending.rfind(b"\n") + 1 :]
+                    continue
+                pending = pending[start + 2 :]
+            started = True
+        records = pending.split(b"\n>")
+        # the last record may continue in the next block
+        pending = records.pop()
+        for record in records:
+            yield _split_record(record)
+    if started:
+        yield _split_record(pending)
+
+
+def read_fasta(path, block_size=READ_BLOCK_SIZE):
+    """Yield (header, sequence) of every record of a plain or gzip FASTA file."""
+    with open_fasta(path) as f:
+        yield from iter_fasta(f, block_size)
+
+
+def header_id(header):
+    """Sequence ID of a header: the text up to the first whitespace."""
+    return header.split(None, 1)[0] if header else b""
+
+
+def format_fasta(header, seq, width=FASTA_LINE_WIDTH):
+    """Return one FASTA record as bytes, the sequence wrapped like Bio.SeqIO writes it."""
+    lines = [b">" + header]
+    lines.extend(seq[ii : ii + width] for ii in range(0, len(seq), width))
+    lines.append(b"")
+    return b"\n".join(lines)
+
+
+def write_fasta(handle, records, width=FASTA_LINE_WIDTH, batch_size=10000):
+    """Write (header, sequence) records to a binary handle, a batch at a time."""
+    n_records = 0
+    batch = []
+    for header, seq in records:
+        batch.append(format_fasta(header, seq, width))
+        if len(batch) >= batch_size:
+            handle.write(b"".join(batch))
+            n_records += len(batch)
+            batch = []
+    if batch:
+        handle.write(b"".join(batch))
+        n_records += len(batch)
+    return n_records
+
+
+def iter_batches(iterable, batch_size):
+    """Yield lists of up to batch_size consecutive items."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def ordered_pool_map(func, tasks, threads=1, max_inflight=None):
+    """
+    Yield func(task) for every task, in task order.
+
+    With several threads the tasks run in a process pool, at most max_inflight of
+    them (default: 2 x threads) are submitted or waiting to be consumed at any time,
+    so memory does not grow with the number of tasks. With one thread the tasks run
+    in this process.
+    """
+    tasks = iter(tasks)
+    if threads <= 1:
+        yield from map(func, tasks)
+        return
+    max_inflight = max_inflight or threads * 2
+    with ProcessPoolExecutor(max_workers=threads) as executor:
+        pending = deque(
+            executor.submit(func, task) for task in itertools.islice(tasks, max_inflight)
+        )
+        while pending:
+            result = pending.popleft().result()
+            for task in itertools.islice(tasks, 1):
+                pending.append(executor.submit(func, task))
+            yield result
+
+
+def has_duplicate_hashes(hash_lst):
+    """Check uint64 ID hashes (see catalog_index.hash_ids) of several blocks for duplicates."""
+    if not hash_lst:
+        return False
+    hashes = np.sort(np.concatenate(hash_lst))
+    return bool(np.any(hashes[1:] == hashes[:-1]))
@@ -1,48 +1,93 @@
 #!/usr/bin/env python
 
-import gzip
-from Bio import SeqIO
-
 import logging
 import sys
 from pathlib import Path
 
 import click
 
+from fasta_stream import open_fasta_out, read_fasta, write_fasta
+from gene_coords import GeneCoordsBuilder, coords_path, parse_partial
+
 logger = logging.getLogger()
 
 
+def filter_prodigal_records(
+    records,
+    skip_partial: bool = True,
+    remove_termination_marker: bool = True,
+    convert_header: bool = True,
+    minlength: int = 0,
+    coords: GeneCoordsBuilder = None,
+):
+    """
+    Filter and rename Prodigal gene records, (header, sequence) pairs of bytes.
+
+    Prodigal headers look like "k141_1_2 # 2 # 301 # 1 # ID=1_2;partial=00;...";
+    converted IDs are contig::rel_pos::start::end::strand. Genes shorter than
+    minlength are skipped; the coordinates of the kept genes are added to coords.
+    """
+    for header, seq in records:
+        seq_id, start, end, strand, note = header.split(b" # ")
+
+        if skip_partial:
+            if b"partial=00" not in note:
+                continue
+
+        if convert_header:
+            contig, _, rel_pos = seq_id.rpartition(b"_")
+            strand_symbol = b"+" if strand == b"1" else b"-"
+            header = b"::".join([contig, rel_pos, start, end, strand_symbol])
+        else:
+            header = b" ".join(header.split())
+
+        if remove_termination_marker:
+            if seq.endswith(b"*"):
+                seq = seq[:-1]
+
+        if len(seq) < minlength:
+            continue
+
+        if coords is not None:
+            contig, _, rel_pos = seq_id.rpartition(b"_")
+            coords.append(
+                contig,
+                int(rel_pos),
+                int(start),
+                int(end),
+                1 if strand == b"1" else -1,
+                len(seq),
+                parse_partial(note),
+            )
+
+        yield header, seq
+
+
 def process_prodigal_fasta(
     fasta_file: str,
     output_file: str,
     skip_partial: bool = True,
     remove_termination_marker: bool = True,
     convert_header: bool = True,
+    coords_file: str = None,
 ):
-    with open(output_file, "w") as output:
-        with gzip.open(fasta_file, "rt") as handle:
-            for fasta_record in SeqIO.parse(handle, "fasta"):
-                seq_id, start, end, strand, note = fasta_record.description.split(" # ")
-
-                if convert_header:
-                    tmp_lst = seq_id.split("_")
-
-                    rel_pos = tmp_lst[-1]
-                    contig = "_".join(tmp_lst[:-1])
-                    strand_symbol = "+" if strand == "1" else "-"
-                    new_id = f"{contig}::{rel_pos}::{start}::{end}::{strand_symbol}"
-                    fasta_record.id = new_id
-                    fasta_record.description = ""
-
-                if skip_partial:
-                    if "partial=00" not in note:
-                        continue
-
-                if remove_termination_marker:
-                    if fasta_record.seq[-1] == "*":
-                        fasta_record.seq = fasta_record.seq[:-1]
-
-                SeqIO.write(fasta_record, output, "fasta")
+    # plain or gzip input, output is gzip compressed when it ends with .gz
+    # the gene coordinates are written to coords_file (see gene_coords.py) if given
+    coords = GeneCoordsBuilder() if coords_file else None
+    with open_fasta_out(output_file) as output:
+        n_genes = write_fasta(
+            output,
+            filter_prodigal_records(
+                read_fasta(fasta_file),
+                skip_partial=skip_partial,
+                remove_termination_marker=remove_termination_marker,
+                convert_header=convert_header,
+                coords=coords,
+            ),
+        )
+    if coords is not None:
+        coords.build().save(coords_file)
+    return n_genes
 
 
 @click.command()
@@ -57,7 +102,12 @@ def process_prodigal_fasta(
         ["CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"], case_sensitive=False
     ),
 )
-def main(fasta, out, log_level):
+@click.option(
+    "--coords/--no-coords",
+    default=True,
+    help="Write the gene coordinates to OUT.coords.npz (default: on).",
+)
+def main(fasta, out, log_level, coords):
     """Coordinate argument parsing and program execution."""
     logging.basicConfig(level=log_level, format="[%(levelname)s] %(message)s")
 
@@ -67,13 +117,15 @@ def main(fasta, out, log_level):
 
     Path(out).parent.mkdir(parents=True, exist_ok=True)
 
-    process_prodigal_fasta(
+    n_genes = process_prodigal_fasta(
         fasta_file=fasta,
         output_file=out,
         skip_partial=True,
         remove_termination_marker=True,
         convert_header=True,
+        coords_file=coords_path(out) if coords else None,
     )
+    logger.info(f"{n_genes} genes written to {out}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+
+import re
+import sys
+import logging
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+from catalog_index import hash_ids
+from gene_id_codec import GeneIdCodec
+from gene_matrix import GeneMatrix, is_gene_matrix
+
+# Configure logging
+title = Path(__file__).name
+logger = logging.getLogger(title)
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+
+# return {protein_id:FG}, FG tables written by functional_group_annotation.py
+def _load_FG_table(FG_fp, sep="\t"):
+    FG_dic = {}
+    with open(FG_fp, "r") as f:
+        for ii, line in enumerate(f):
+            if ii == 0:
+                continue  # skip headers
+            lst = line.rstrip("\n").split(sep)
+            FG_dic[lst[0]] = lst[1]
+    return FG_dic
+
+
+def _FG_label(FG_fp):
+    """Database of an FG table, e.g. Pfam for protein_catalog.FG_IPS_Pfam.tsv."""
+    name = Path(FG_fp).name
+    match = re.search(r"FG_IPS_(.+)\.tsv$", name)
+    return match.group(1) if match else Path(FG_fp).stem
+
+
+# yield ([duplicate_id, ...], [representative_id, ...]) chunks of the duplicate map
+# written by translate_fasta.py --collapse-duplicates
+def _iter_duplicate_chunks(dup_map_fp, chunk_size=1000000, sep="\t"):
+    dup_lst = []
+    rep_lst = []
+    with open(dup_map_fp, "r") as f:
+        next(f, None)  # skip headers
+        for line in f:
+            dup_id, rep_id = line.rstrip("\n").split(sep)
+            dup_lst.append(dup_id)
+            rep_lst.append(rep_id)
+            if len(dup_lst) >= chunk_size:
+                yield dup_lst, rep_lst
+                dup_lst = []
+                rep_lst = []
+    if dup_lst:
+        yield dup_lst, rep_lst
+
+
+# yield (representative_id, [member_id, ...]) per cluster, representative included
+def _iter_cdhit_clusters(clstr_fp):
+    """
+    Iterate over a CD-HIT .clstr file, e.g.
+
+    >Cluster 0
+    0	310aa, >geneA... *
+    1	305aa, >geneB... at 96.72%
+
+    IDs are read up to the first whitespace (cd-hit -d 0) without the trailing '...'.
+    """
+    rep_id = None
+    member_lst = []
+    with open(clstr_fp, "r") as f:
+        for line in f:
+            if line.startswith(">"):
+                if member_lst:
+                    yield rep_id, member_lst
+                rep_id = None
+                member_lst = []
+                continue
+            seq_id = line.split(">", 1)[1].split(maxsplit=1)[0]
+            if seq_id.endswith("..."):
+                seq_id = seq_id[:-3]
+            member_lst.append(seq_id)
+            if line.rstrip().endswith("*"):
+                rep_id = seq_id
+    if member_lst:
+        yield rep_id, member_lst
+
+
+class GeneFGMap:
+    """
+    Gene to functional group lookup through the CD-HIT protein clusters.
+
+    Genes are stored as sorted 64-bit ID hashes (see catalog_index) with the integer
+    code of their FG, so the map takes 12 bytes per annotated gene instead of one
+    Python string per gene. With a gene ID codec, the map is one int32 FG code per
+    catalog gene instead. Proteins keep the ID of the gene they were translated from;
+    genes whose identical protein was collapsed before clustering (dup_map_fp, see
+    translate_fasta.py --collapse-duplicates) join the cluster of their representative.
+
+    The cluster file and the duplicate map are read in chunks that are turned into
+    hashes (or codes) right away, so no gene ID strings are kept.
+    """
+
+    def __init__(self, FG_dic, clstr_fp, codec=None, dup_map_fp=None, chunk_size=1000000):
+        FG_codes, self.FG_lst = pd.factorize(pd.Series(list(FG_dic.values()), dtype=object))
+        rep_code = dict(zip(FG_dic.keys(), FG_codes.astype(np.int32)))
+
+        self.codec = codec
+        if codec is not None:
+            gene_keys = lambda ids, source: codec.encode_strict(ids, source)
+        else:
+            gene_keys = lambda ids, source: hash_ids(ids)
+
+        key_lst = []
+        code_lst = []
+        member_lst = []
+        member_code_lst = []
+        n_clusters = 0
+        for rep_id, cluster_member_lst in _iter_cdhit_clusters(clstr_fp):
+            code = rep_code.get(rep_id)
+            if code is None:
+                continue  # representative without annotation
+            n_clusters += 1
+            member_lst.extend(cluster_member_lst)
+            member_code_lst.extend([code] * len(cluster_member_lst))
+            if len(member_lst) >= chunk_size:
+                key_lst.append(gene_keys(member_lst, clstr_fp))
+                code_lst.append(np.asarray(member_code_lst, dtype=np.int32))
+                member_lst = []
+                member_code_lst = []
+        key_lst.append(gene_keys(member_lst, clstr_fp))
+        code_lst.append(np.asarray(member_code_lst, dtype=np.int32))
+        del member_lst, member_code_lst
+
+        if dup_map_fp:
+            # duplicates get the FG code of their representative, looked up by key
+            member_keys = np.concatenate(key_lst)
+            member_codes = np.concatenate(code_lst)
+            order = np.argsort(member_keys, kind="stable")
+            member_keys = member_keys[order]
+            member_codes = member_codes[order]
+            for dup_lst, rep_lst in _iter_duplicate_chunks(dup_map_fp, chunk_size):
+                rep_keys = gene_keys(rep_lst, dup_map_fp)
+                pos = np.searchsorted(member_keys, rep_keys)
+                pos[pos == len(member_keys)] = 0
+                found = (len(member_keys) > 0) & (member_keys[pos] == rep_keys)
+                key_lst.append(gene_keys(dup_lst, dup_map_fp)[found])
+                code_lst.append(member_codes[pos[found]])
+            del member_keys, member_codes
+
+        keys = np.concatenate(key_lst)
+        codes = np.concatenate(code_lst)
+        del key_lst, code_lst
+
+        if codec is not None:
+            self.code_FG = np.full(len(codec), -1, dtype=np.int32)
+            self.code_FG[keys] = codes
+            logger.info(
+                f"{len(keys)} genes in {n_clusters} annotated clusters, {len(self.FG_lst)} FGs"
+            )
+            return
+
+        order = np.argsort(keys, kind="stable")
+        self.hashes = keys[order]
+        self.codes = codes[order]
+        if len(self.hashes) > 1 and np.any(self.hashes[1:] == self.hashes[:-1]):
+            raise ValueError(
+                "Duplicated gene IDs (or ID hash collision) in the cluster file {0}.".format(
+                    clstr_fp
+                )
+            )
+        logger.info(
+            f"{len(self.hashes)} genes in {n_clusters} annotated clusters, {len(self.FG_lst)} FGs"
+        )
+
+    def __len__(self):
+        if self.codec is not None:
+            return int(np.count_nonzero(self.code_FG >= 0))
+        return len(self.hashes)
+
+    def lookup(self, gene_ids):
+        """Return the FG code of each gene ID, -1 for genes without FG."""
+        if self.codec is not None:
+            codes = self.codec.encode(gene_ids)
+            return np.where(codes >= 0, self.code_FG[codes], -1)
+        query = hash_ids(gene_ids)
+        pos = np.searchsorted(self.hashes, query)
+        pos[pos == len(self.hashes)] = 0
+        found = (len(self.hashes) > 0) & (self.hashes[pos] == query)
+        return np.where(found, self.codes[pos], -1)
+
+
+def _iter_abundance_chunks(abundance_fp, chunk_size=200000, sep="\t"):
+    """Yield (sample_ids, gene_ids, values) chunks of a gene x sample table (TSV or binary matrix)."""
+    if is_gene_matrix(abundance_fp):
+        matrix = GeneMatrix(abundance_fp)
+        for start in range(0, matrix.shape[0], chunk_size):
+            end = min(start + chunk_size, matrix.shape[0])
+            yield matrix.sample_ids, list(matrix.row_ids[start:end]), np.asarray(
+                matrix.values[start:end]
+            )
+        return
+    for chunk in pd.read_csv(
+        abundance_fp,
+        sep=sep,
+        index_col=0,
+        chunksize=chunk_size,
+        float_precision="round_trip",
+    ):
+        yield list(chunk.columns), list(chunk.index.astype(str)), chunk.to_numpy()
+
+
+def _group_sum(acc, codes, values):
+    """Add the rows of values to acc[code] (vectorized group-by sum), rows with code -1 are skipped."""
+    valid = codes >= 0
+    codes = codes[valid]
+    if len(codes) == 0:
+        return
+    values = values[valid]
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    uniq_codes, starts = np.unique(codes, return_index=True)
+    acc[uniq_codes] += np.add.reduceat(values[order], starts, axis=0)
+
+
+def calculate_FG_abundance(
+    abundance_fp,
+    clstr_fp,
+    FG_fp_lst,
+    output_prefix,
+    chunk_size=200000,
+    codec_fp=None,
+    dup_map_fp=None,
+):
+    """
+    Sum gene abundances into FG x sample tables, streaming the gene table once.
+
+    Parameters:
+    - abundance_fp (str): Gene x sample abundance (TSV or binary gene matrix).
+    - clstr_fp (str): CD-HIT .clstr file of the protein catalog.
+    - FG_fp_lst (list): FG tables (protein_id, FG) of the cluster representatives.
+    - output_prefix (str): Writes <output_prefix>.FG_<database>.tsv per FG table.
+    - chunk_size (int): Number of genes read at once.
+    - codec_fp (str): Optional gene ID codec, genes are looked up by int32 code.
+    - dup_map_fp (str): Optional duplicate -> representative protein map of the catalog.
+
+    Returns:
+    - list: Paths of the written tables.
+    """
+    codec = GeneIdCodec.load(codec_fp) if codec_fp else None
+    FG_maps = []
+    for FG_fp in FG_fp_lst:
+        logger.info(f"Loading FG table: {FG_fp}")
+        FG_maps.append(
+            (
+                _FG_label(FG_fp),
+                GeneFGMap(_load_FG_table(FG_fp), clstr_fp, codec, dup_map_fp),
+            )
+        )
+
+    sample_lst = None
+    acc_lst = None
+    n_genes = 0
+    n_assigned = [0] * len(FG_maps)
+    for chunk_samples, gene_ids, values in _iter_abundance_chunks(
+        abundance_fp, chunk_size
+    ):
+        if acc_lst is None:
+            sample_lst = chunk_samples
+            acc_dtype = np.int64 if np.issubdtype(values.dtype, np.integer) else np.float64
+            acc_lst = [
+                np.zeros((len(FG_map.FG_lst), len(sample_lst)), dtype=acc_dtype)
+                for _, FG_map in FG_maps
+            ]
+        values = values.astype(acc_lst[0].dtype, copy=False)
+        n_genes += len(gene_ids)
+        for ii, (_, FG_map) in enumerate(FG_maps):
+            codes = FG_map.lookup(gene_ids)
+            n_assigned[ii] += int(np.count_nonzero(codes >= 0))
+            _group_sum(acc_lst[ii], codes, values)
+
+    if acc_lst is None:
+        raise ValueError(f"No genes in abundance table {abundance_fp}")
+
+    sfp_lst = []
+    for (label, FG_map), acc, n_gene_FG in zip(FG_maps, acc_lst, n_assigned):
+        logger.info(f"{label}: {n_gene_FG} of {n_genes} genes assigned to an FG")
+        sfp = f"{output_prefix}.FG_{label}.tsv"
+        FG_abd = pd.DataFrame(acc, index=pd.Index(FG_map.FG_lst, name="FG"), columns=sample_lst)
+        FG_abd.to_csv(sfp, sep="\t")
+        sfp_lst.append(sfp)
+    return sfp_lst
+
+
+@click.command(context_settings={"help_option_names": ["-h", "--help"]})
+@click.option(
+    "-a",
+    "--abundance",
+    required=True,
+    type=click.Path(exists=True),
+    help="Gene x sample abundance table (merged CoverM TSV or binary .npy gene matrix).",
+)
+@click.option(
+    "-c",
+    "--clusters",
+    required=True,
+    type=click.Path(exists=True),
+    help="CD-HIT .clstr file of the protein catalog.",
+)
+@click.option(
+    "-f",
+    "--fg-table",
+    "FG_tables",
+    required=True,
+    multiple=True,
+    type=click.Path(exists=True),
+    help="FG table(s) of the representative proteins (*.FG_IPS_<database>.tsv), repeat for several.",
+)
+@click.option(
+    "-o",
+    "--output-prefix",
+    required=True,
+    type=str,
+    help="Output prefix, writes PREFIX.FG_<database>.tsv per FG table.",
+)
+@click.option(
+    "--chunk-size",
+    type=int,
+    default=200000,
+    help="Number of genes read at once.",
+)
+@click.option(
+    "--id-codec",
+    type=click.Path(exists=True),
+    default=None,
+    help="Gene ID codec (see gene_id_codec.py): the gene map is one int32 FG code per catalog gene.",
+)
+@click.option(
+    "-d",
+    "--duplicate-map",
+    type=click.Path(exists=True),
+    default=None,
+    help="Duplicate -> representative protein map (translate_fasta.py --collapse-duplicates), duplicates join the cluster of their representative.",
+)
+def main(
+    abundance, clusters, FG_tables, output_prefix, chunk_size, id_codec, duplicate_map
+):
+    """
+    Functional group (FG) x sample abundance: genes are mapped to their CD-HIT protein
+    cluster, the cluster to the FG of its representative, and gene rows are summed per FG.
+    """
+    try:
+        calculate_FG_abundance(
+            abundance,
+            clusters,
+            list(FG_tables),
+            output_prefix,
+            chunk_size,
+            id_codec,
+            duplicate_map,
+        )
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
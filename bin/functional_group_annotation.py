@@ -1,77 +1,192 @@
 #!/usr/bin/env python
 
-import os, glob, sys
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
+import click
 
-# return {protein_id:[length,start,end,Pfam_id,Pfam_description,eval]}
-def _load_FG_interproscan_Pfam(
+from gene_id_codec import GeneIdCodec
+
+
+# return {ann_tool:{protein_id:[[start,member_db_id],...]}} in file order
+def _load_FG_interproscan(
     interproscan_fp,
-    ann_tool,
+    ann_tool_lst,
+    max_eval=None,
+    ann_tool_idx=3,
     start_pos_idx=6,
-    pfam_id_idx=4,
+    member_id_idx=4,
     eval_idx=8,
-    prot_len_idx=2,
 ):
-    ann_dic = {}
-    cur_ann_tool = ann_tool
+    ann_dic = {ann_tool: {} for ann_tool in ann_tool_lst}
     with open(interproscan_fp, "r") as f:
         for line in f:
-            if cur_ann_tool not in line:
+            lst = line.rstrip("\n").split("\t")
+            # analysis column, e.g. Pfam, TIGRFAM, CDD
+            if len(lst) <= eval_idx or lst[ann_tool_idx] not in ann_dic:
                 continue
-            lst = line.strip().split("\t")
+            if max_eval is not None:
+                try:
+                    cur_eval = float(lst[eval_idx])
+                except ValueError:
+                    cur_eval = None  # no e-value reported ("-"), kept
+                if cur_eval is not None and cur_eval > max_eval:
+                    continue
+            cur_ann_dic = ann_dic[lst[ann_tool_idx]]
             protein_id = lst[0]
             start_pos = int(lst[start_pos_idx])
-            end_pos = int(lst[start_pos_idx + 1])
-            pfam_id = lst[pfam_id_idx]
-            pfam_ann = lst[pfam_id_idx + 1]
-            cur_eval = float(lst[eval_idx])
-            prot_len = int(lst[prot_len_idx])
-            if protein_id not in ann_dic:
-                ann_dic[protein_id] = []
-            ann_dic[protein_id].append(
-                [prot_len, start_pos, end_pos, pfam_id, pfam_ann, cur_eval]
-            )
+            member_id = lst[member_id_idx]
+            if protein_id not in cur_ann_dic:
+                cur_ann_dic[protein_id] = []
+            cur_ann_dic[protein_id].append([start_pos, member_id])
     return ann_dic
 
 
+# ID codec of the worker processes, protein IDs are returned as int32 codes when set
+_shard_codec = None
+
+
+def _init_shard_worker(codec_fp):
+    global _shard_codec
+    _shard_codec = GeneIdCodec.load(codec_fp) if codec_fp else None
+
+
+def _load_FG_shard(args):
+    # worker entry point: (interproscan_fp, ann_tool_lst, max_eval)
+    ann_dic = _load_FG_interproscan(*args)
+    if _shard_codec is None:
+        return ann_dic
+    coded_ann_dic = {}
+    for ann_tool, cur_ann_dic in ann_dic.items():
+        protein_codes = _shard_codec.encode_strict(list(cur_ann_dic), args[0])
+        coded_ann_dic[ann_tool] = dict(zip(protein_codes.tolist(), cur_ann_dic.values()))
+    return coded_ann_dic
+
+
+def _read_shard_list(shard_list_fp):
+    with open(shard_list_fp, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _FG_sfp(output_prefix, ann_tool):
+    return "{0}.FG_IPS_{1}.tsv".format(output_prefix, ann_tool)
+
+
 def _calculate_functional_group(
-    interproscan_fp,
-    FG_sfp,
-    ann_tool="Pfam",
-    start_pos_idx=6,
-    pfam_id_idx=4,
-    eval_idx=8,
-    prot_len_idx=2,
+    interproscan_fp_lst,
+    output_prefix,
+    ann_tool_lst=["Pfam"],
+    max_eval=None,
+    threads=1,
+    codec_fp=None,
 ):
-    ann_dic = _load_FG_interproscan_Pfam(
-        interproscan_fp, ann_tool, start_pos_idx, pfam_id_idx, eval_idx, prot_len_idx
-    )
-    # return: {protein_id:[length,start,end,Pfam_id,Pfam_description,eval]}
-
-    # add create functino group for each protein
-    # (1) sort by start position for each protein
-    # print([it for it in ann_dic if len(ann_dic[it])>1])
-    # cur_protein_id =  'cohort_merged__MSMA26EN_k105_33921::5::4320::6767::+'
-    FG_annotation_dic = {}
-    for cur_protein_id in ann_dic:
-        cur_ann_rec = ann_dic[cur_protein_id]
-        cur_start_lst = [it[1] for it in cur_ann_rec]
-        cur_start_lst__sorted_idx = sorted(
-            range(len(cur_start_lst)), key=lambda i: cur_start_lst[i]
-        )
-        cur_ann_rec__sorted = [cur_ann_rec[idx] for idx in cur_start_lst__sorted_idx]
-        cur_FG = ":::".join([it[3] for it in cur_ann_rec__sorted])
-        FG_annotation_dic[cur_protein_id] = cur_FG
-    # save to file
-    with open(FG_sfp, "w") as sf:
-        sf.write("\t".join(["protein_id", "FG"]) + "\n")
-        for protein_id in FG_annotation_dic:
-            sf.write("\t".join([protein_id, FG_annotation_dic[protein_id]]) + "\n")
+    # parse the InterProScan shards in parallel, each is reduced to per-protein domain
+    # lists of every member database in one scan
+    # with an ID codec, proteins are int32 codes until the output is written
+    # return: {ann_tool:{protein_id:[[start,member_db_id],...]}}, merged in shard order
+    ann_dic = {ann_tool: {} for ann_tool in ann_tool_lst}
+    shard_args = [
+        (interproscan_fp, ann_tool_lst, max_eval)
+        for interproscan_fp in interproscan_fp_lst
+    ]
+    with ProcessPoolExecutor(
+        max_workers=max(threads, 1),
+        initializer=_init_shard_worker,
+        initargs=(codec_fp,),
+    ) as executor:
+        for shard_ann_dic in executor.map(_load_FG_shard, shard_args, chunksize=4):
+            for ann_tool, shard_tool_dic in shard_ann_dic.items():
+                cur_ann_dic = ann_dic[ann_tool]
+                for protein_id, shard_rec in shard_tool_dic.items():
+                    if protein_id not in cur_ann_dic:
+                        cur_ann_dic[protein_id] = []
+                    cur_ann_dic[protein_id].extend(shard_rec)
+
+    # create the functional group of each protein, domains sorted by start position
+    # (stable sort, so domains starting at the same position stay in file order)
+    # one file per member database: <output_prefix>.FG_IPS_<ann_tool>.tsv
+    codec = GeneIdCodec.load(codec_fp) if codec_fp else None
+    for ann_tool in ann_tool_lst:
+        protein_id_lst = list(ann_dic[ann_tool])
+        if codec is not None:
+            protein_id_lst = codec.decode(protein_id_lst)
+        with open(_FG_sfp(output_prefix, ann_tool), "w") as sf:
+            sf.write("\t".join(["protein_id", "FG"]) + "\n")
+            for protein_id, cur_ann_rec in zip(
+                protein_id_lst, ann_dic[ann_tool].values()
+            ):
+                cur_ann_rec__sorted = sorted(cur_ann_rec, key=lambda it: it[0])
+                cur_FG = ":::".join([it[1] for it in cur_ann_rec__sorted])
+                sf.write("\t".join([protein_id, cur_FG]) + "\n")
     return
 
 
-if __name__ == "__main__":
-    interproscan_fp = sys.argv[1]  # merged interproscan file
-    FG_sfp = sys.argv[2]  # output file
+@click.command(context_settings={"help_option_names": ["-h", "--help"]})
+@click.argument("shards", type=click.Path(exists=True), nargs=-1)
+@click.option(
+    "-l",
+    "--shard-list",
+    type=click.Path(exists=True),
+    default=None,
+    help="File listing InterProScan TSV shards, one path per line (added after SHARDS).",
+)
+@click.option(
+    "-o",
+    "--output-prefix",
+    type=str,
+    default="protein_catalog",
+    help="Output prefix, writes PREFIX.FG_IPS_<DATABASE>.tsv for each database.",
+)
+@click.option(
+    "-d",
+    "--database",
+    "databases",
+    type=str,
+    multiple=True,
+    default=["Pfam"],
+    help="InterProScan member database (analysis column) to group, repeat for several (default: Pfam).",
+)
+@click.option(
+    "-e",
+    "--max-evalue",
+    type=float,
+    default=None,
+    help="Skip matches with a larger e-value (default: keep all).",
+)
+@click.option(
+    "--id-codec",
+    type=click.Path(exists=True),
+    default=None,
+    help="Gene/protein ID codec (see gene_id_codec.py): proteins are kept as int32 codes and decoded when writing.",
+)
+@click.option(
+    "-t",
+    "--threads",
+    type=int,
+    default=1,
+    help="Number of worker processes parsing shards.",
+)
+def main(shards, shard_list, output_prefix, databases, max_evalue, id_codec, threads):
+    """
+    Build functional groups (member database entries ordered by start position) for each protein.
 
-    _calculate_functional_group(interproscan_fp, FG_sfp)
+    SHARDS: InterProScan TSV files, parsed in parallel and merged in the given order.
+    """
+    shard_lst = list(shards)
+    if shard_list:
+        shard_lst.extend(_read_shard_list(shard_list))
+    if not shard_lst:
+        sys.exit("No InterProScan files given.")
+
+    _calculate_functional_group(
+        shard_lst,
+        output_prefix,
+        ann_tool_lst=list(dict.fromkeys(databases)),
+        max_eval=max_evalue,
+        threads=threads,
+        codec_fp=id_codec,
+    )
+
+
+if __name__ == "__main__":
+    main()
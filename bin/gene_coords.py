@@ -0,0 +1,156 @@
+"""
+Columnar gene coordinate table written next to filtered Prodigal genes and gene catalogs.
+
+Gene IDs carry their coordinates as contig::rel_pos::start::end::strand, but splitting
+millions of ID strings again in every downstream step is slow. The table keeps them as
+arrays indexed by gene ordinal (position in the FASTA file, which is also the code of
+a gene ID codec built from the same file), saved as <fasta>.coords.npz:
+
+- contig_ids: contig names, packed as one newline separated uint8 buffer
+- contig: int32 position in contig_ids of the contig of each gene
+- rel_pos: int32 gene number on the contig (the Prodigal ID suffix)
+- start / end: int64 1-based coordinates on the contig, start <= end
+- strand: int8, 1 or -1
+- length: int32 length of the written nucleotide sequence
+- partial: uint8 Prodigal partial flag as two bits, 0 for complete genes
+  (partial=10 -> 2: left end incomplete, partial=01 -> 1: right end incomplete)
+"""
+
+import numpy as np
+
+COORDS_SUFFIX = ".coords.npz"
+COORD_FIELDS = {
+    "contig": np.int32,
+    "rel_pos": np.int32,
+    "start": np.int64,
+    "end": np.int64,
+    "strand": np.int8,
+    "length": np.int32,
+    "partial": np.uint8,
+}
+
+
+def coords_path(fasta_path):
+    return str(fasta_path) + COORDS_SUFFIX
+
+
+def parse_partial(note):
+    """Two-bit partial flag from a Prodigal note such as b"ID=1_2;partial=10;..."."""
+    pos = note.find(b"partial=")
+    if pos < 0:
+        return 0
+    flag = note[pos + 8 : pos + 10]
+    return (flag[:1] == b"1") * 2 + (flag[1:2] == b"1")
+
+
+class GeneCoords:
+    """
+    Gene coordinates as parallel arrays, see the module docstring for the columns.
+
+    Contig names stay packed as bytes until contig_ids is first used, so tables of
+    many samples are stacked without one Python string per contig.
+    """
+
+    def __init__(self, contig_packed, n_contigs, columns):
+        self.contig_packed = contig_packed
+        self.n_contigs = n_contigs
+        self.columns = columns
+        self._contig_ids = None
+
+    @classmethod
+    def load(cls, coords_fp):
+        with np.load(coords_fp) as data:
+            contig_packed = data["contig_ids"].tobytes()
+            columns = {field: data[field] for field in COORD_FIELDS}
+        n_contigs = contig_packed.count(b"\n") + 1 if contig_packed else 0
+        return cls(contig_packed, n_contigs, columns)
+
+    def save(self, coords_fp):
+        # through a handle, so np.savez keeps the name as given (no .npz appended)
+        with open(coords_fp, "wb") as f:
+            np.savez(
+                f,
+                contig_ids=np.frombuffer(self.contig_packed, dtype=np.uint8),
+                **self.columns,
+            )
+        return coords_fp
+
+    @classmethod
+    def concatenate(cls, coords_lst, contig_prefix_lst=None):
+        """
+        Stack tables of consecutive FASTA files, e.g. samples of a catalog.
+
+        contig_prefix_lst optionally prefixes the contig names of each table, as the
+        S<n>C renaming of the catalog does for the gene IDs.
+        """
+        packed_lst = []
+        n_contigs = 0
+        columns = {field: [] for field in COORD_FIELDS}
+        for ii, coords in enumerate(coords_lst):
+            for field in COORD_FIELDS:
+                values = coords.columns[field]
+                if field == "contig":
+                    values = values + n_contigs
+                columns[field].append(values)
+            if coords.n_contigs > 0:
+                packed = coords.contig_packed
+                if contig_prefix_lst:
+                    prefix = contig_prefix_lst[ii].encode()
+                    packed = prefix + packed.replace(b"\n", b"\n" + prefix)
+                packed_lst.append(packed)
+            n_contigs += coords.n_contigs
+        return cls(
+            b"\n".join(packed_lst),
+            n_contigs,
+            {
+                field: np.concatenate(columns[field]).astype(dtype, copy=False)
+                if coords_lst
+                else np.empty(0, dtype=dtype)
+                for field, dtype in COORD_FIELDS.items()
+            },
+        )
+
+    def __len__(self):
+        return len(self.columns["start"])
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    @property
+    def contig_ids(self):
+        if self._contig_ids is None:
+            names = self.contig_packed.decode().split("\n") if self.n_contigs else []
+            self._contig_ids = np.asarray(names, dtype=object)
+        return self._contig_ids
+
+    def contigs(self, gene_idx):
+        """Contig names of the genes at the given ordinals."""
+        return self.contig_ids[self.columns["contig"][gene_idx]]
+
+
+class GeneCoordsBuilder:
+    """Collects the coordinates of genes as they are written, contigs are numbered on first use."""
+
+    def __init__(self):
+        self.contig_code = {}
+        self.rows = []
+
+    def append(self, contig, rel_pos, start, end, strand, length, partial):
+        code = self.contig_code.get(contig)
+        if code is None:
+            code = self.contig_code[contig] = len(self.contig_code)
+        self.rows.append((code, rel_pos, start, end, strand, length, partial))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def build(self):
+        columns = {}
+        for ii, (field, dtype) in enumerate(COORD_FIELDS.items()):
+            columns[field] = np.fromiter(
+                (row[ii] for row in self.rows), dtype=dtype, count=len(self.rows)
+            )
+        contig_lst = [
+            it.encode() if isinstance(it, str) else it for it in self.contig_code
+        ]
+        return GeneCoords(b"\n".join(contig_lst), len(contig_lst), columns)
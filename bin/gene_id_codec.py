@@ -0,0 +1,163 @@
+"""
+Catalog-wide gene/protein ID codec (string <-> int32) shared by the bin/ helpers.
+
+Gene IDs such as contig::rel_pos::start::end::strand are long Python strings; at
+10M+ genes, dict keys, lists and pandas indexes of them dominate memory. The codec
+numbers every catalog ID once (code = position in the catalog) and is saved next to
+the catalog as one numpy archive (<catalog>.ids.npz):
+
+- data / offsets: all IDs as one uint8 buffer, ID of code i is data[offsets[i]:offsets[i + 1]]
+- hashes / hash_codes: 64-bit ID hashes (see catalog_index.hash_id), sorted, with their code
+
+Proteins keep the ID of the gene they were translated from, so the same codec serves
+both. Encoding looks up the hash and checks the stored ID, so IDs that are not in the
+catalog encode to -1, even on hash collisions.
+"""
+
+import numpy as np
+
+from catalog_index import hash_ids
+from fasta_stream import open_fasta
+
+CODEC_SUFFIX = ".ids.npz"
+
+
+def codec_path(fasta_path):
+    return str(fasta_path) + CODEC_SUFFIX
+
+
+def read_fasta_ids(fasta_path):
+    """Yield the sequence IDs (header up to the first whitespace) of a plain or gzip/BGZF FASTA file."""
+    with open_fasta(fasta_path) as f:
+        for line in f:
+            if line.startswith(b">"):
+                yield line[1:].split(maxsplit=1)[0].decode()
+
+
+class GeneIdCodec:
+    """
+    Bulk string <-> int32 encoding of catalog IDs.
+
+    Build it with from_ids or from_fasta, save it once and load it in every helper.
+    It holds the IDs as one byte buffer plus 20 bytes per ID for offsets and hashes.
+    """
+
+    def __init__(self, data, offsets, hashes, hash_codes):
+        self.data = data
+        self.offsets = offsets
+        self.hashes = hashes
+        self.hash_codes = hash_codes
+        self._buffer = None
+
+    @classmethod
+    def from_ids(cls, ids):
+        """Number IDs in the given order, duplicated IDs raise a ValueError."""
+        encoded = [it.encode() for it in ids]
+        if len(encoded) >= 2**31:
+            raise ValueError("Too many IDs for int32 codes: {0}".format(len(encoded)))
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(it) for it in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+        hashes = hash_ids(encoded)
+        hash_codes = np.argsort(hashes, kind="stable").astype(np.int32)
+        hashes = hashes[hash_codes]
+        codec = cls(data, offsets, hashes, hash_codes)
+
+        # equal hashes are either duplicated IDs or (rarely) collisions, which encode resolves
+        same = np.flatnonzero(hashes[1:] == hashes[:-1])
+        for pos in same:
+            if codec._id_bytes(hash_codes[pos]) == codec._id_bytes(hash_codes[pos + 1]):
+                raise ValueError(
+                    "Duplicated ID: {0}".format(codec._id_bytes(hash_codes[pos]).decode())
+                )
+        return codec
+
+    @classmethod
+    def from_fasta(cls, fasta_path):
+        return cls.from_ids(read_fasta_ids(fasta_path))
+
+    @classmethod
+    def load(cls, codec_fp):
+        with np.load(codec_fp) as data:
+            return cls(
+                data["data"], data["offsets"], data["hashes"], data["hash_codes"]
+            )
+
+    def save(self, codec_fp):
+        # through a handle, so np.savez keeps the name as given (no .npz appended)
+        with open(codec_fp, "wb") as f:
+            np.savez(
+                f,
+                data=self.data,
+                offsets=self.offsets,
+                hashes=self.hashes,
+                hash_codes=self.hash_codes,
+            )
+        return codec_fp
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def buffer(self):
+        if self._buffer is None:
+            self._buffer = np.asarray(self.data).tobytes()
+        return self._buffer
+
+    def _id_bytes(self, code):
+        return self.buffer[self.offsets[code] : self.offsets[code + 1]]
+
+    def encode(self, ids):
+        """
+        Encode IDs (str) to int32 codes.
+
+        Returns:
+        - numpy.ndarray: int32 code of each ID, -1 for IDs that are not in the codec.
+        """
+        encoded = [it.encode() for it in ids]
+        query = hash_ids(encoded)
+        n_hashes = len(self.hashes)
+        pos = np.searchsorted(self.hashes, query, side="left")
+        hit = pos < n_hashes
+        hit[hit] = self.hashes[pos[hit]] == query[hit]
+        codes = np.full(len(encoded), -1, dtype=np.int32)
+
+        buffer = self.buffer
+        offsets = self.offsets.tolist()
+        hashes = self.hashes
+        hash_codes = self.hash_codes
+        for ii in np.flatnonzero(hit).tolist():
+            seq_id = encoded[ii]
+            cur_pos = int(pos[ii])
+            # usually a single candidate, more only on hash collisions
+            while cur_pos < n_hashes and hashes[cur_pos] == query[ii]:
+                code = int(hash_codes[cur_pos])
+                if buffer[offsets[code] : offsets[code + 1]] == seq_id:
+                    codes[ii] = code
+                    break
+                cur_pos += 1
+        return codes
+
+    def decode(self, codes):
+        """Decode int codes back to the ID strings, as a list."""
+        buffer = self.buffer
+        offsets = self.offsets.tolist()
+        return [
+            buffer[offsets[code] : offsets[code + 1]].decode()
+            for code in np.asarray(codes).tolist()
+        ]
+
+    def encode_strict(self, ids, source="input"):
+        """Encode IDs and raise a ValueError if any of them is not in the codec."""
+        codes = self.encode(ids)
+        missing = np.flatnonzero(codes < 0)
+        if len(missing) > 0:
+            ids = ids if isinstance(ids, list) else list(ids)
+            raise ValueError(
+                "{0} IDs of {1} are not in the ID codec, e.g. {2}".format(
+                    len(missing), source, ids[missing[0]]
+                )
+            )
+        return codes
+
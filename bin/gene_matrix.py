@@ -0,0 +1,114 @@
+"""
+Binary gene x sample abundance matrix shared by coverm_merge.py and postminer_utils.py.
+
+A matrix saved under a prefix is made of three files:
+
+- <prefix>.npy: float32 matrix (genes x samples), memory-mapped when loaded
+- <prefix>.rows.txt: one row (gene) ID per line, in matrix order
+- <prefix>.samples.txt: one column (sample) name per line, in matrix order
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+MATRIX_SUFFIX = ".npy"
+ROWS_SUFFIX = ".rows.txt"
+SAMPLES_SUFFIX = ".samples.txt"
+
+
+def matrix_prefix(path):
+    """Return the prefix of a gene matrix given either the prefix or the .npy path."""
+    path = str(path)
+    if path.endswith(MATRIX_SUFFIX):
+        return path[: -len(MATRIX_SUFFIX)]
+    return path
+
+
+def is_gene_matrix(path):
+    """Check whether the path points to a binary gene matrix (.npy file or its prefix)."""
+    return Path(matrix_prefix(path) + MATRIX_SUFFIX).is_file()
+
+
+def _write_lines(fp, values):
+    with open(fp, "w") as f:
+        for it in values:
+            f.write(str(it) + "\n")
+
+
+def _read_lines(fp):
+    with open(fp, "r") as f:
+        return [line.rstrip("\n") for line in f]
+
+
+def save_gene_matrix(prefix, df, chunk_size=500000):
+    """
+    Save a gene x sample DataFrame as a float32 matrix with row and column sidecars.
+
+    Parameters:
+    - prefix (str): Output prefix, the .npy/.rows.txt/.samples.txt suffixes are added.
+    - df (pandas.DataFrame): Abundance table, genes as index and samples as columns.
+    - chunk_size (int): Number of rows converted and written at once.
+    """
+    prefix = matrix_prefix(prefix)
+    matrix = np.lib.format.open_memmap(
+        prefix + MATRIX_SUFFIX, mode="w+", dtype=np.float32, shape=df.shape
+    )
+    for start in range(0, df.shape[0], chunk_size):
+        end = min(start + chunk_size, df.shape[0])
+        matrix[start:end] = df.iloc[start:end].to_numpy(dtype=np.float32)
+    matrix.flush()
+    del matrix
+
+    _write_lines(prefix + ROWS_SUFFIX, df.index)
+    _write_lines(prefix + SAMPLES_SUFFIX, df.columns)
+
+
+class GeneMatrix:
+    """
+    Read-only access to a binary gene matrix.
+
+    The values are memory-mapped, so gathering the rows of a few thousand genes only
+    touches those rows on disk.
+    """
+
+    def __init__(self, path):
+        prefix = matrix_prefix(path)
+        self.values = np.load(prefix + MATRIX_SUFFIX, mmap_mode="r")
+        self.row_ids = pd.Index(_read_lines(prefix + ROWS_SUFFIX))
+        self.sample_ids = _read_lines(prefix + SAMPLES_SUFFIX)
+
+        if self.values.shape != (len(self.row_ids), len(self.sample_ids)):
+            raise ValueError(
+                "Gene matrix {0} has shape {1}, but the sidecars list {2} rows and {3} samples.".format(
+                    prefix, self.values.shape, len(self.row_ids), len(self.sample_ids)
+                )
+            )
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def row_index(self, ids):
+        """Return the matrix row of each ID, -1 for IDs that are not in the matrix."""
+        return self.row_ids.get_indexer(list(ids))
+
+    def gather(self, ids, columns=None, dtype=np.float64):
+        """
+        Gather the rows of the selected IDs.
+
+        Parameters:
+        - ids (iterable): Row IDs to extract, missing IDs are skipped.
+        - columns (slice or array): Optional column selection.
+        - dtype: dtype of the returned values.
+
+        Returns:
+        - tuple: (row_ids, values) with rows in matrix order.
+        """
+        rows = self.row_index(ids)
+        rows = np.unique(rows[rows >= 0])  # sorted, so the reads stay sequential
+        values = self.values[rows]
+        if columns is not None:
+            values = values[:, columns]
+        return list(self.row_ids[rows]), np.asarray(values, dtype=dtype)
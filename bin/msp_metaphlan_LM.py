@@ -1,178 +1,739 @@
 #!/usr/bin/env python3
 
 import os
+import gzip
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import click
-from sklearn import datasets, linear_model
-from sklearn.metrics import mean_squared_error, r2_score
 import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import rankdata
 
 
-# return {msp_id:{sample_id:msp_abd(RPKM)}}
-def _load_msp_profile(msp_profile_fp, sep="\t", has_column_header=False):
+def _open_profile(fp):
+    """Open a profile table for reading as text, gzip-compressed or plain."""
+    with open(fp, "rb") as f:
+        magic = f.read(2)
+    if magic == b"\x1f\x8b":
+        return gzip.open(fp, "rt")
+    return open(fp, "r")
+
+
+def _read_profile_table(fp, sep="\t"):
+    """
+    Read a feature x sample table, skipping the '#' lines before its header.
+
+    The header may or may not name the ID column.
+
+    Returns:
+        tuple: (feature IDs, sample IDs, n_features x n_samples float64 array)
+    """
+    with _open_profile(fp) as f:
+        header = f.readline()
+        while header.startswith("#"):
+            header = f.readline()
+        sample_lst = header.rstrip("\r\n").split(sep)
+        df = pd.read_csv(
+            f,
+            sep=sep,
+            header=None,
+            index_col=0,
+            dtype={0: str},
+            float_precision="round_trip",
+        )
+    if len(sample_lst) == df.shape[1] + 1:
+        sample_lst = sample_lst[1:]
+    if len(sample_lst) != df.shape[1]:
+        raise ValueError(
+            "{0}: header lists {1} samples, but the rows have {2} values.".format(
+                fp, len(sample_lst), df.shape[1]
+            )
+        )
+    return list(df.index), sample_lst, df.to_numpy(dtype=np.float64)
+
+
+# return msp_id_lst, sample_id_lst, n_msp x n_samples abundances (RPKM)
+def _load_msp_profile(msp_profile_fp, sep="\t"):
     """
     Load MSP abundance profile from file.
 
     Parameters:
-        msp_profile_fp (str): Path to MSP profile file.
+        msp_profile_fp (str): Path to MSP profile file, plain or gzip-compressed.
         sep (str): Delimiter used in the file.
-        has_column_header (bool): If True, the first column of the header contains sample IDs.
 
     Returns:
-        dict: Nested dictionary {msp_id: {sample_id: RPKM_value}}.
+        tuple: (msp_id list, sample_id list, n_msp x n_samples array of RPKM values).
     """
-    ret_abd_prev = {}
-    ret_sample_lst = []
-    with open(msp_profile_fp, "r") as f:
-        for ii, line in enumerate(f):
-            if ii == 0:
-                if has_column_header:
-                    ret_sample_lst = line.strip().split(sep)[1:]
-                else:
-                    ret_sample_lst = line.strip().split(sep)
-                continue
-            lst = line.strip().split(sep)
-            ret_abd_prev[lst[0]] = [float(it) for it in lst[1:]]
-    # reformat the abundance list by sample_id
-    ret_abd = {}
-    for msp_id in ret_abd_prev:
-        ret_abd[msp_id] = dict(zip(ret_sample_lst, ret_abd_prev[msp_id]))
-    return ret_abd
+    return _read_profile_table(msp_profile_fp, sep=sep)
 
 
-# return {spp:metaphlan_abd_lst(relative abd)},sample_id_lst
+# return spp_lst, sample_id_lst, n_spp x n_samples abundances (relative abd)
 def _load_metaphlan_profile(metaphlan_profile_fp, sep="\t"):
     """
     Load MetaPhlAn relative abundance profile from combined output format.
 
+    Only species-level entries (containing 's__') are kept, and the _microbial/_paired
+    suffixes are removed from the sample IDs.
+
     Parameters:
-        metaphlan_profile_fp (str): Path to MetaPhlAn combined profile file.
+        metaphlan_profile_fp (str): Path to MetaPhlAn combined profile file, plain or gzip-compressed.
         sep (str): Delimiter used in the file (default: tab-separated).
 
     Returns:
-        dict: Nested dictionary {species: {sample_id: relative_abundance}}.
+        tuple: (species list, sample_id list, n_spp x n_samples array of relative abundances).
     """
-    ret_abd_prev = {}
-    ret_sample_lst = []
-    with open(metaphlan_profile_fp, "r") as f:
-        for ii, line in enumerate(f):
-            # Skip header lines starting with #
-            if line.startswith("#"):
-                continue
+    clade_lst, sample_lst, abd = _read_profile_table(metaphlan_profile_fp, sep=sep)
+    sample_lst = [
+        sample.replace("_microbial", "").replace("_paired", "") for sample in sample_lst
+    ]
+    spp_rows = [ii for ii, clade in enumerate(clade_lst) if "s__" in clade]
+    spp_lst = [clade_lst[ii] for ii in spp_rows]
+    return spp_lst, sample_lst, np.ascontiguousarray(abd[spp_rows])
 
-            # First data line contains sample IDs
-            if ii == 0 or (ii == 1 and len(ret_sample_lst) == 0):
-                lst = line.strip().split(sep)
-                # Skip first column (clade_name), get sample IDs
-                ret_sample_lst = [
-                    sample.replace("_microbial", "").replace("_paired", "")
-                    for sample in lst[1:]
-                ]
-                continue
 
-            lst = line.strip().split(sep)
-            # First column is the species/taxa name
-            spp_name = lst[0]
-            # Only process species-level entries (containing 's__')
-            if "s__" in spp_name:
-                abundances = [float(abd) for abd in lst[1:]]
-                ret_abd_prev[spp_name] = abundances
+def _align_samples(msp_sample_lst, msp_mat, metaphlan_sample_lst, spp_mat):
+    """
+    Keep the samples of both profiles, in MetaPhlAn order, through a hashed sample index.
 
-    # reformat the abundance list by sample_id
-    ret_abd = {}
-    for spp in ret_abd_prev:
-        ret_abd[spp] = dict(zip(ret_sample_lst, ret_abd_prev[spp]))
+    Returns:
+        tuple: (sample_id list, MSP matrix, species matrix) with matching columns.
+    """
+    msp_cols = pd.Index(msp_sample_lst).get_indexer(metaphlan_sample_lst)
+    shared = np.flatnonzero(msp_cols >= 0)
+    sample_id_lst = [metaphlan_sample_lst[ii] for ii in shared]
+    return (
+        sample_id_lst,
+        np.ascontiguousarray(msp_mat[:, msp_cols[shared]]),
+        np.ascontiguousarray(spp_mat[:, shared]),
+    )
+
+
+def _center_profiles(mat):
+    """
+    Center each row of a profile matrix.
+
+    Returns:
+        list: [centered rows, row means, row sums of squares around the mean]
+    """
+    mean = mat.mean(axis=1)
+    centered = mat - mean[:, None]
+    sum_sq = np.einsum("ij,ij->i", centered, centered)
+    return [centered, mean, sum_sq]
 
-    return ret_abd
+
+def _sparse_profiles(mat):
+    """
+    Store species profiles as a CSR matrix, most species are absent from most samples.
+
+    Returns:
+        list: [CSR rows, row means, row sums of squares around the mean]
+    """
+    csr = sparse.csr_matrix(mat, dtype=np.float64)
+    csr.eliminate_zeros()
+    n_rows, n_samples = csr.shape
+    nnz = np.diff(csr.indptr)
+    mean = np.asarray(csr.sum(axis=1)).ravel() / n_samples
+    # non-zero deviations plus the (x - mean)^2 = mean^2 of every zero
+    dev = csr.data - np.repeat(mean, nnz)
+    sum_sq = np.bincount(
+        np.repeat(np.arange(n_rows), nnz), weights=dev * dev, minlength=n_rows
+    ) + (n_samples - nnz) * mean**2
+    return [csr, mean, sum_sq]
+
+
+def _nonzero_pattern(csr):
+    """Return the non-zero pattern of a CSR matrix as a float32 CSR matrix of ones."""
+    pattern = csr.astype(np.float32, copy=True)
+    pattern.data[:] = 1.0
+    return pattern
+
+
+def _linear_fit_centered(msp_prep, spp_prep, n_samples):
+    """
+    Fit every MSP on every species from their centered profiles (see _center_profiles).
+
+    coefficient = Sxy / Sxx, intercept = mean(y) - coefficient * mean(x),
+    MSE = (Syy - coefficient * Sxy) / n and R2 = 1 - SSE / Syy, which is the
+    least-squares solution of one LinearRegression per pair. The species rows may
+    also be the raw CSR profiles of _sparse_profiles, as the MSP rows are centered
+    Sxy = sum((y - mean(y)) * x).
+
+    Returns:
+        list: [coefficients, intercepts, MSE, R2], each an n_msp x n_spp array.
+    """
+    msp_centered, msp_mean, syy = msp_prep
+    spp_rows, spp_mean, sxx = spp_prep
+    sxy = np.asarray(spp_rows @ msp_centered.T).T
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # a species without variance is fitted by the MSP mean alone (coefficient 0)
+        coef = np.where(sxx > 0, sxy / sxx, 0.0)
+        intercept = msp_mean[:, None] - coef * spp_mean[None, :]
+        sse = np.maximum(syy[:, None] - coef * sxy, 0.0)
+        mse = sse / n_samples
+        # as r2_score: a constant MSP is perfectly fitted (1.0)
+        r2 = np.where(syy[:, None] > 0, 1.0 - sse / syy[:, None], 1.0)
+
+    return [coef, intercept, mse, r2]
 
 
 # return the Coefficients,Interceptions,Mean squared error, and r2 values
-def _linear_fit_Apair(cur_msp_id, cur_spp, metaphlan_abd, msp_abd, sample_id_lst):
+def _linear_fit_matrix(msp_mat, spp_mat):
     """
-    Perform linear regression between one MSP and one species across shared samples.
+    Fit a simple linear regression of every MSP on every species at once.
 
     Parameters:
-        cur_msp_id (str): MSP ID.
-        cur_spp (str): Species name from MetaPhlAn.
-        metaphlan_abd (dict): Species abundance {spp: {sample_id: value}}.
-        msp_abd (dict): MSP abundance {msp_id: {sample_id: value}}.
-        sample_id_lst (list): Sample IDs to include in the regression.
+        msp_mat (np.ndarray): MSP abundances, n_msp x n_samples (response).
+        spp_mat (np.ndarray): Species abundances, n_spp x n_samples (predictor).
 
     Returns:
-        list: [coefficient, intercept, MSE, R2 score]
+        list: [coefficients, intercepts, MSE, R2], each an n_msp x n_spp array.
     """
-    cur_metaphlan_abd = np.array(
-        [
-            float(metaphlan_abd[cur_spp][cur_sample_id])
-            for cur_sample_id in sample_id_lst
-        ]
+    return _linear_fit_centered(
+        _center_profiles(msp_mat), _center_profiles(spp_mat), msp_mat.shape[1]
     )
-    cur_metaphlan_abd = cur_metaphlan_abd.reshape((len(cur_metaphlan_abd), 1))
-    cur_msp_abd = np.array(
-        [float(msp_abd[cur_msp_id][cur_sample_id]) for cur_sample_id in sample_id_lst]
+
+
+LM_FIELDS = ["coefficients", "interceptions", "MSE", "r2"]
+
+# association metrics, the last field of each is the score used to rank the species
+# lm: linear regression of the MSP on the species (R2)
+# pearson: Pearson correlation of the abundances
+# spearman: Pearson correlation of the ranks of each profile across samples
+# log: Pearson correlation of log(abundance + pseudocount)
+METRIC_FIELDS = {
+    "lm": LM_FIELDS,
+    "pearson": ["r"],
+    "spearman": ["rho"],
+    "log": ["r"],
+}
+METRIC_LABELS = {"lm": "LM", "pearson": "pearson", "spearman": "spearman", "log": "logPearson"}
+# float64 MSP x species arrays held per metric while a tile is scored
+METRIC_PAIR_ARRAYS = {"lm": 8, "pearson": 3, "spearman": 3, "log": 3}
+# added to the best matches by --permutations
+PERMUTATION_FIELDS = ["p_value", "p_adj_max"]
+
+
+def _rank_rows(mat):
+    """
+    Rank each profile across samples (average ranks for ties).
+
+    Ranks are shifted so that absent (zero) abundances stay at 0, which keeps sparse
+    profiles sparse; correlations do not depend on the shift.
+    """
+    ranks = rankdata(mat, axis=1)
+    n_zero = np.sum(mat == 0, axis=1)
+    return np.where(mat != 0, ranks - (n_zero[:, None] + 1) / 2.0, 0.0)
+
+
+def _log_rows(mat, pseudocount=None):
+    """
+    log(abundance + pseudocount) - log(pseudocount), so absent abundances stay at 0.
+
+    The default pseudocount is half of the smallest non-zero abundance of the whole
+    matrix, one value for all of its profiles.
+    """
+    if pseudocount is None:
+        nonzero = mat[mat > 0]
+        pseudocount = nonzero.min() / 2.0 if nonzero.size > 0 else 1.0
+    return np.log1p(mat / pseudocount)
+
+
+def _metric_profiles(
+    metric, msp_mat, spp_mat, msp_pseudocount=None, spp_pseudocount=None
+):
+    """
+    Return the (MSP, species) profiles a metric is computed on.
+
+    MSP RPKM and MetaPhlAn relative abundances are on different scales, so each
+    matrix has its own pseudocount for the log metric.
+    """
+    if metric == "spearman":
+        return _rank_rows(msp_mat), _rank_rows(spp_mat)
+    if metric == "log":
+        return _log_rows(msp_mat, msp_pseudocount), _log_rows(spp_mat, spp_pseudocount)
+    return msp_mat, spp_mat
+
+
+def _correlation_centered(msp_prep, spp_prep):
+    """
+    Pearson correlation of every MSP with every species from their centered profiles.
+
+    Pairs where either profile is constant get r = 0.
+
+    Returns:
+        list: [r], an n_msp x n_spp array.
+    """
+    msp_centered, _, syy = msp_prep
+    spp_rows, _, sxx = spp_prep
+    sxy = np.asarray(spp_rows @ msp_centered.T).T
+    denom = np.sqrt(syy[:, None] * sxx[None, :])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = np.where(denom > 0, sxy / denom, 0.0)
+    return [np.clip(r, -1.0, 1.0)]
+
+
+def _score_metric(metric, msp_prep, spp_prep, n_samples):
+    if metric == "lm":
+        return _linear_fit_centered(msp_prep, spp_prep, n_samples)
+    return _correlation_centered(msp_prep, spp_prep)
+
+
+def _select_top_k(score, top_k):
+    """
+    Column indices of the top_k highest scores of every row, best first.
+
+    Ties keep the earlier column, so the best match is the first species reaching
+    the maximum score.
+    """
+    top_k = min(top_k, score.shape[1])
+    return np.argsort(-score, axis=1, kind="stable")[:, :top_k]
+
+
+def _merge_top_k(best_idx, best_vals, tile_idx, tile_vals, top_k, score_pos=-1):
+    """
+    Merge the running top_k of a block of MSPs with the top_k of a new species tile.
+
+    Candidates are ordered by score, then by species index, which gives the same
+    selection as _select_top_k over all species at once.
+    """
+    cand_idx = np.concatenate([best_idx, tile_idx], axis=1)
+    cand_vals = [np.concatenate(pair, axis=1) for pair in zip(best_vals, tile_vals)]
+    order = np.lexsort((cand_idx, -cand_vals[score_pos]), axis=1)[:, :top_k]
+    return np.take_along_axis(cand_idx, order, axis=1), [
+        np.take_along_axis(val, order, axis=1) for val in cand_vals
+    ]
+
+
+def _tile_sizes(n_msp, n_spp, n_samples, memory_budget_mb, threads=1, pair_arrays=8):
+    """
+    Pick MSP and species tile sizes that keep each worker within its memory share.
+
+    A tile needs pair_arrays float64 MSP x species arrays while it is scored, plus
+    the centered profiles of its MSPs and species.
+    """
+    budget = memory_budget_mb * 2**20 / max(threads, 1)
+    bytes_pair = 8 * pair_arrays
+    bytes_row = 8 * n_samples
+    # largest square tile: bytes_pair * t^2 + 2 * bytes_row * t <= budget
+    side = (-bytes_row + math.sqrt(bytes_row**2 + bytes_pair * budget)) / bytes_pair
+    spp_tile = max(1, min(n_spp, int(side)))
+    # spend what is left on the MSP axis when the species axis is short
+    msp_tile = int((budget - spp_tile * bytes_row) / (bytes_pair * spp_tile + bytes_row))
+    msp_tile = max(1, min(n_msp, msp_tile))
+    return msp_tile, spp_tile
+
+
+# shared by the worker processes of score_all
+_tile_args = None
+
+
+def _init_tile_worker(
+    metric_preps,
+    msp_pattern,
+    spp_pattern,
+    n_samples,
+    top_k,
+    keep_full,
+    min_shared,
+    permutations=None,
+    obs_idx=None,
+):
+    global _tile_args
+    _tile_args = (
+        metric_preps,
+        msp_pattern,
+        spp_pattern,
+        n_samples,
+        top_k,
+        keep_full,
+        min_shared,
+        permutations,
+        obs_idx,
     )
-    cur_msp_abd = cur_msp_abd.reshape((len(cur_msp_abd), 1))
-    # linear model
-    # Create linear regression object
-    regr = linear_model.LinearRegression()
-
-    # Fit a linear model
-    regr.fit(cur_metaphlan_abd, cur_msp_abd)
-    cur_msp_abd_pred = regr.predict(cur_metaphlan_abd)
-    mse = mean_squared_error(cur_msp_abd, cur_msp_abd_pred)
-    r2 = r2_score(cur_msp_abd, cur_msp_abd_pred)
-
-    return [regr.coef_, regr.intercept_, mse, r2]
-
-
-# run through all paired msp_id and metaphlan spp
-# save to output_dir as a file named: msp_metaphlan_LM.full.txt
-# columns as: "metaphlan_spp","msp_id","coefficients","interceptions","MSE","r2"
-# modified from examples in https://scikit-learn.org/stable/auto_examples/linear_model/plot_ols.html
-def linear_fit_all(full_res_sfp, msp_id_lst, spp_lst, metaphlan_abd, msp_abd):
-    res = {}
-    metaphlan_sample_id_lst = list(metaphlan_abd[spp_lst[0]].keys())
-    msp_sample_id_lst = list(msp_abd[msp_id_lst[0]].keys())
-    sample_id_lst = [it for it in metaphlan_sample_id_lst if it in msp_sample_id_lst]
-    print("N samples: ", len(sample_id_lst))
-    # print("msp missing samples:", [it for it in metaphlan_sample_id_lst if it not in msp_sample_id_lst])
-    # print("metaphlan missing samples:", [it for it in msp_sample_id_lst if it not in metaphlan_sample_id_lst])
 
-    for cur_msp_id in msp_id_lst:
-        for cur_spp in spp_lst:
-            res[(cur_spp, cur_msp_id)] = _linear_fit_Apair(
-                cur_msp_id, cur_spp, metaphlan_abd, msp_abd, sample_id_lst
+
+def _score_tile(task):
+    """
+    Score one MSP x species tile with every metric.
+
+    Pairs sharing fewer than min_shared non-zero samples are not scored: species
+    without any candidate MSP in the tile are left out, the remaining pruned pairs
+    get a -inf score (NaN in the full results).
+
+    task is (bounds, perm_no). With perm_no = -1 the tile is reduced to the top_k
+    species of each MSP per metric. Otherwise the species samples are shuffled by
+    permutation perm_no and the tile is reduced to the maximum score of each MSP and
+    the scores of its observed top_k species (obs_idx) that fall into the tile.
+
+    Returns:
+        tuple: (bounds, perm_no, {metric: (top species, top values, full tile results or None)}
+        or {metric: (max scores, observed species in tile, their scores)}, N pruned pairs)
+    """
+    (
+        metric_preps,
+        msp_pattern,
+        spp_pattern,
+        n_samples,
+        top_k,
+        keep_full,
+        min_shared,
+        permutations,
+        obs_idx,
+    ) = _tile_args
+    bounds, perm_no = task
+    msp_start, msp_end, spp_start, spp_end = bounds
+    n_tile_msp = msp_end - msp_start
+    n_tile_spp = spp_end - spp_start
+
+    def spp_tile(rows):
+        # species rows of the tile, with shuffled samples in a permutation
+        rows = rows[spp_start:spp_end]
+        return rows if perm_no < 0 else rows[:, permutations[perm_no]]
+
+    candidate = None
+    spp_cols = np.arange(n_tile_spp)
+    n_pruned = 0
+    if min_shared > 0:
+        shared = np.asarray(spp_tile(spp_pattern) @ msp_pattern[msp_start:msp_end].T).T
+        candidate = shared >= min_shared
+        spp_cols = np.flatnonzero(candidate.any(axis=0))
+        candidate = candidate[:, spp_cols]
+        n_pruned = n_tile_msp * n_tile_spp - int(np.count_nonzero(candidate))
+
+    tile_res = {}
+    for metric, (msp_prep, spp_prep) in metric_preps.items():
+        spp_rows, spp_mean, spp_sum_sq = spp_prep
+        res = _score_metric(
+            metric,
+            [val[msp_start:msp_end] for val in msp_prep],
+            [
+                spp_tile(spp_rows)[spp_cols],
+                spp_mean[spp_start:spp_end][spp_cols],
+                spp_sum_sq[spp_start:spp_end][spp_cols],
+            ],
+            n_samples,
+        )
+        if candidate is not None:
+            res[-1][~candidate] = -np.inf
+
+        if perm_no >= 0:
+            score = np.full((n_tile_msp, n_tile_spp), -np.inf)
+            score[:, spp_cols] = res[-1]
+            tile_max = score.max(axis=1)
+            obs_cols = obs_idx[metric][msp_start:msp_end] - spp_start
+            in_tile = (obs_cols >= 0) & (obs_cols < n_tile_spp)
+            obs_scores = np.take_along_axis(
+                score, np.where(in_tile, obs_cols, 0), axis=1
             )
+            tile_res[metric] = (tile_max, in_tile, obs_scores)
+            continue
 
-    with open(full_res_sfp, "w") as sf:
-        sf.write(
-            "\t".join(
-                [
-                    "metaphlan_spp",
-                    "msp_id",
-                    "coefficients",
-                    "interceptions",
-                    "MSE",
-                    "r2",
-                ]
+        top_idx = _select_top_k(res[-1], top_k)
+        top_vals = [np.take_along_axis(val, top_idx, axis=1) for val in res]
+        top_idx = spp_cols[top_idx] + spp_start
+        # slots filled by pruned pairs are marked -1, score_all turns them into empty slots
+        top_idx[np.isneginf(top_vals[-1])] = -1
+
+        tile_full = None
+        if keep_full:
+            tile_full = []
+            for val in res:
+                if candidate is not None:
+                    val = np.where(candidate, val, np.nan)
+                full_val = np.full((n_tile_msp, n_tile_spp), np.nan)
+                full_val[:, spp_cols] = val
+                tile_full.append(full_val)
+        tile_res[metric] = (top_idx, top_vals, tile_full)
+    return bounds, perm_no, tile_res, n_pruned
+
+
+def _run_tiles(worker_args, tasks, reduce_tile, threads=1):
+    """Score the tile tasks, in order, and hand each result to reduce_tile."""
+    if threads <= 1 or len(tasks) <= 1:
+        _init_tile_worker(*worker_args)
+        for task in tasks:
+            reduce_tile(_score_tile(task))
+        return
+    # forked workers share the profiles instead of receiving copies
+    with ProcessPoolExecutor(
+        max_workers=threads,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_tile_worker,
+        initargs=worker_args,
+    ) as executor:
+        for tile_out in executor.map(_score_tile, tasks):
+            reduce_tile(tile_out)
+
+
+# run through all paired msp_id and metaphlan spp in MSP x species tiles, scoring every metric
+# keep the top_k species of each MSP (by the score of each metric) while the tiles are scored
+# pairs sharing less than min_shared_samples non-zero samples and species present in
+# less than min_prevalence of the samples are pruned before scoring
+# return {metric: {"spp_idx": n_msp x top_k, field: n_msp x top_k}}, {metric: full results} or None
+# empty top_k slots (no candidate species left) have spp_idx = n_spp and score = -inf
+# with permutations > 0, p_value and p_adj_max are added (see _permutation_p_values)
+def score_all(
+    msp_mat,
+    spp_mat,
+    metrics=("lm",),
+    top_k=1,
+    keep_full=False,
+    threads=1,
+    memory_budget_mb=2048,
+    min_shared_samples=0,
+    min_prevalence=0.0,
+    msp_pseudocount=None,
+    spp_pseudocount=None,
+    permutations=0,
+    seed=0,
+):
+    n_msp, n_samples = msp_mat.shape
+    n_spp = spp_mat.shape[0]
+    top_k = min(top_k, n_spp)
+
+    # transformed profiles of each metric, computed once for all tiles
+    metric_preps = {}
+    for metric in metrics:
+        msp_vals, spp_vals = _metric_profiles(
+            metric, msp_mat, spp_mat, msp_pseudocount, spp_pseudocount
+        )
+        metric_preps[metric] = [_center_profiles(msp_vals), _sparse_profiles(spp_vals)]
+
+    # absent stays absent in every transformed profile
+    spp_pattern = _nonzero_pattern(_sparse_profiles(spp_mat)[0])
+    # MSP profiles are dense, shared counts are CSR species x dense MSP products
+    msp_pattern = (msp_mat != 0).astype(np.float32)
+    print(
+        "MetaPhlAn profile density: {0:.4f}".format(
+            spp_pattern.nnz / max(n_spp * n_samples, 1)
+        )
+    )
+
+    # prevalence filter, the remaining species are tiled
+    prevalence = np.diff(spp_pattern.indptr) / max(n_samples, 1)
+    spp_keep = np.flatnonzero(prevalence >= min_prevalence)
+    if len(spp_keep) < n_spp:
+        for msp_prep, spp_prep in metric_preps.values():
+            spp_prep[:] = [val[spp_keep] for val in spp_prep]
+        spp_pattern = spp_pattern[spp_keep]
+    n_keep = len(spp_keep)
+
+    tile_bounds = []
+    if n_keep > 0:
+        msp_tile, spp_tile = _tile_sizes(
+            n_msp,
+            n_keep,
+            n_samples,
+            memory_budget_mb,
+            threads,
+            pair_arrays=sum(METRIC_PAIR_ARRAYS[metric] for metric in metrics),
+        )
+        tile_bounds = [
+            (msp_start, min(msp_start + msp_tile, n_msp), spp_start, min(spp_start + spp_tile, n_keep))
+            for msp_start in range(0, n_msp, msp_tile)
+            for spp_start in range(0, n_keep, spp_tile)
+        ]
+        print(
+            "N tiles: {0} ({1} MSPs x {2} species)".format(
+                len(tile_bounds), msp_tile, spp_tile
             )
-            + "\n"
         )
-        for cur_spp, cur_msp_id in res:
-            sf.write(
-                "\t".join(
-                    [cur_spp, cur_msp_id]
-                    + [str(float(val)) for val in res[(cur_spp, cur_msp_id)]]
-                )
-                + "\n"
+
+    # running top_k of each metric, empty slots lose against every species
+    best_idx = {}
+    best_vals = {}
+    full = {} if keep_full else None
+    for metric in metrics:
+        fields = METRIC_FIELDS[metric]
+        best_idx[metric] = np.full((n_msp, top_k), n_keep, dtype=np.int64)
+        best_vals[metric] = [np.zeros((n_msp, top_k)) for _ in fields]
+        best_vals[metric][-1][:] = -np.inf
+        if keep_full:
+            full[metric] = [np.full((n_msp, n_spp), np.nan) for _ in fields]
+    n_pruned = n_msp * (n_spp - n_keep)
+
+    def reduce_tile(tile_out):
+        nonlocal n_pruned
+        (msp_start, msp_end, spp_start, spp_end), _, tile_res, tile_pruned = tile_out
+        n_pruned += tile_pruned
+        for metric, (tile_idx, tile_vals, tile_full) in tile_res.items():
+            tile_idx[tile_idx < 0] = n_keep
+            block_idx, block_vals = _merge_top_k(
+                best_idx[metric][msp_start:msp_end],
+                [val[msp_start:msp_end] for val in best_vals[metric]],
+                tile_idx,
+                tile_vals,
+                top_k,
             )
-    return
+            best_idx[metric][msp_start:msp_end] = block_idx
+            for val, block_val in zip(best_vals[metric], block_vals):
+                val[msp_start:msp_end] = block_val
+            if tile_full is not None:
+                spp_cols = spp_keep[spp_start:spp_end]
+                for full_val, val in zip(full[metric], tile_full):
+                    full_val[msp_start:msp_end, spp_cols] = val
+
+    worker_args = (
+        metric_preps,
+        msp_pattern,
+        spp_pattern,
+        n_samples,
+        top_k,
+        keep_full,
+        min_shared_samples,
+    )
+    _run_tiles(worker_args, [(bounds, -1) for bounds in tile_bounds], reduce_tile, threads)
+
+    print(
+        "Pruned MSP-species pairs: {0} of {1} ({2:.1%})".format(
+            n_pruned, n_msp * n_spp, n_pruned / max(n_msp * n_spp, 1)
+        )
+    )
+
+    p_values = {}
+    if permutations > 0 and len(tile_bounds) > 0:
+        p_values = _permutation_p_values(
+            worker_args,
+            tile_bounds,
+            best_idx,
+            {metric: best_vals[metric][-1] for metric in metrics},
+            permutations,
+            seed,
+            threads,
+        )
+
+    # back to the species index of spp_mat, n_spp for the empty slots
+    spp_idx_map = np.append(spp_keep, n_spp)
+    best = {}
+    for metric in metrics:
+        best[metric] = {"spp_idx": spp_idx_map[best_idx[metric]]}
+        best[metric].update(zip(METRIC_FIELDS[metric], best_vals[metric]))
+        best[metric].update(p_values.get(metric, {}))
+    return best, full
+
+
+def _permutation_p_values(
+    worker_args, tile_bounds, obs_idx, obs_score, permutations, seed=0, threads=1
+):
+    """
+    Empirical p-values of the observed top_k matches from shuffled species samples.
+
+    Each permutation shuffles the sample labels of all species at once and rescores
+    every tile with the same kernels, pruning included. p_adj_max needs the best
+    species of every MSP in each permutation, so all pairs are rescored and N
+    permutations cost about N full scoring passes, without early stopping.
+
+    - p_value: (1 + N permutations where the pair scores >= observed) / (N + 1)
+    - p_adj_max: (1 + N permutations where the best species of the MSP scores >= observed) / (N + 1),
+      the max-statistic over all species, which accounts for testing every species
+
+    Returns:
+        dict: {metric: {"p_value": n_msp x top_k, "p_adj_max": n_msp x top_k}}, NaN for empty slots.
+    """
+    n_samples = worker_args[3]
+    rng = np.random.default_rng(seed)
+    perm_matrix = np.array([rng.permutation(n_samples) for _ in range(permutations)])
+    print("N permutations: ", permutations)
+
+    n_pair_exceed = {}
+    max_exceed = {}
+    for metric, score in obs_score.items():
+        n_pair_exceed[metric] = np.zeros(score.shape, dtype=np.int64)
+        max_exceed[metric] = np.zeros((permutations,) + score.shape, dtype=bool)
+
+    def reduce_perm(tile_out):
+        (msp_start, msp_end, _, _), perm_no, tile_res, _ = tile_out
+        for metric, (tile_max, in_tile, tile_obs_scores) in tile_res.items():
+            obs = obs_score[metric][msp_start:msp_end]
+            n_pair_exceed[metric][msp_start:msp_end] += in_tile & (tile_obs_scores >= obs)
+            max_exceed[metric][perm_no, msp_start:msp_end] |= tile_max[:, None] >= obs
+
+    perm_args = tuple(worker_args) + (perm_matrix, obs_idx)
+    tasks = [(bounds, perm_no) for perm_no in range(permutations) for bounds in tile_bounds]
+    _run_tiles(perm_args, tasks, reduce_perm, threads)
+
+    ret = {}
+    for metric, score in obs_score.items():
+        empty = np.isneginf(score)
+        p_value = (1.0 + n_pair_exceed[metric]) / (permutations + 1)
+        p_adj_max = (1.0 + max_exceed[metric].sum(axis=0)) / (permutations + 1)
+        p_value[empty] = np.nan
+        p_adj_max[empty] = np.nan
+        ret[metric] = {"p_value": p_value, "p_adj_max": p_adj_max}
+    return ret
+
+
+# linear fit all paired msp_id and metaphlan spp, see score_all
+# return {"spp_idx": n_msp x top_k, "coefficients": ..., "r2": ...}, full results or None
+def linear_fit_all(msp_mat, spp_mat, **kwargs):
+    best, full = score_all(msp_mat, spp_mat, metrics=("lm",), **kwargs)
+    return best["lm"], full["lm"] if full is not None else None
+
+
+def _save_full_LM(full_res_sfp, msp_id_lst, spp_lst, full, fields=LM_FIELDS):
+    """
+    Save all MSP x species scores as a compressed numpy archive.
+
+    The archive holds msp_id and metaphlan_spp arrays plus one n_msp x n_spp
+    matrix per field (coefficients, interceptions, MSE, r2 for the linear fit).
+    """
+    np.savez_compressed(
+        full_res_sfp,
+        msp_id=np.array(msp_id_lst),
+        metaphlan_spp=np.array(spp_lst),
+        **dict(zip(fields, full)),
+    )
+
+
+def _save_best_LM(sfp, msp_id_lst, spp_lst, best, with_rank=False, fields=LM_FIELDS):
+    """
+    Save the best (or top_k) species of each MSP, MSPs sorted by ID.
+
+    Columns: msp_id, [rank,] metaphlan_spp, fields (coefficients, interceptions, MSE, r2
+    for the linear fit). Empty slots (all candidate species pruned) are not written.
+    """
+    header = ["msp_id", "metaphlan_spp"] + fields
+    if with_rank:
+        header.insert(1, "rank")
+    with open(sfp, "w") as sf:
+        sf.write("\t".join(header) + "\n")
+        for ii in sorted(range(len(msp_id_lst)), key=lambda i: msp_id_lst[i]):
+            for rank, spp_idx in enumerate(best["spp_idx"][ii]):
+                if spp_idx >= len(spp_lst):
+                    break
+                row = [msp_id_lst[ii], spp_lst[spp_idx]] + [
+                    str(float(best[field][ii, rank])) for field in fields
+                ]
+                if with_rank:
+                    row.insert(1, str(rank + 1))
+                sf.write("\t".join(row) + "\n")
 
 
 # file format:
 # "metaphlan_spp","msp_id","coefficients","interceptions","MSE","r2"
+# or the compressed archive written by _save_full_LM (.npz)
 # return {("metaphlan_spp","msp_id"):["coefficients","interceptions","MSE","r2"]}
 def load_msp_metaphlan_LM(fp, sep="\t", sel_msp_id_lst=[], sel_metaphlan_spp_lst=[]):
     ret = {}
+    if str(fp).endswith(".npz"):
+        with np.load(fp) as data:
+            msp_id_lst = list(data["msp_id"])
+            spp_lst = list(data["metaphlan_spp"])
+            full = [data[field] for field in LM_FIELDS]
+        for ii, msp_id in enumerate(msp_id_lst):
+            if (len(sel_msp_id_lst) > 0) and (msp_id not in sel_msp_id_lst):
+                continue
+            for jj, metaphlan_spp in enumerate(spp_lst):
+                if (len(sel_metaphlan_spp_lst) > 0) and (
+                    metaphlan_spp not in sel_metaphlan_spp_lst
+                ):
+                    continue
+                ret[(metaphlan_spp, msp_id)] = [float(val[ii, jj]) for val in full]
+        return ret
+
     with open(fp, "r") as f:
         for ii, line in enumerate(f):
             if ii == 0:
@@ -192,74 +753,99 @@ def load_msp_metaphlan_LM(fp, sep="\t", sel_msp_id_lst=[], sel_metaphlan_spp_lst
 
 
 def _msp_taxaANN_metaphlanLM(
-    output_dir, msp_profile_fp, metaphlan_profile_fp, metaphlan_version="v3"
+    output_dir,
+    msp_profile_fp,
+    metaphlan_profile_fp,
+    metaphlan_version="v3",
+    top_k=1,
+    full_table=False,
+    threads=1,
+    memory_budget_mb=2048,
+    min_shared_samples=0,
+    min_prevalence=0.0,
+    metrics=("lm",),
+    msp_pseudocount=None,
+    spp_pseudocount=None,
+    permutations=0,
+    seed=0,
 ):
-    # load abd tables from both msp and metaphlan
-    msp_abd = _load_msp_profile(msp_profile_fp)
-    metaphlan_abd = _load_metaphlan_profile(metaphlan_profile_fp, sep="\t")
-
-    msp_id_lst = list(msp_abd.keys())
-    # Filter to only species-level taxa (containing 's__')
-    spp_lst = [spp for spp in list(metaphlan_abd.keys()) if "s__" in spp]
+    # load abd tables from both msp and metaphlan (species-level taxa only)
+    msp_id_lst, msp_sample_id_lst, msp_mat = _load_msp_profile(msp_profile_fp)
+    spp_lst, metaphlan_sample_id_lst, spp_mat = _load_metaphlan_profile(
+        metaphlan_profile_fp, sep="\t"
+    )
 
     print(f"Loaded {len(msp_id_lst)} MSPs and {len(spp_lst)} species from MetaPhlAn")
 
     if metaphlan_version == "v3":
-        full_res_sfp = os.path.join(output_dir, "msp_metaphlan_LM.full.txt")
-        bestR2_res_sfp = os.path.join(output_dir, "msp_metaphlan_LM.bestR2.txt")
+        res_prefix = os.path.join(output_dir, "msp_metaphlan")
     elif metaphlan_version == "v4":
-        full_res_sfp = os.path.join(output_dir, "msp_metaphlan4_LM.full.txt")
-        bestR2_res_sfp = os.path.join(output_dir, "msp_metaphlan4_LM.bestR2.txt")
+        res_prefix = os.path.join(output_dir, "msp_metaphlan4")
     else:
         print("unknown metaphlan version [v3 or v4]:", metaphlan_version)
         return
-    # linear fit all against all
-    # save everything
-    linear_fit_all(
-        full_res_sfp, msp_id_lst, spp_lst, metaphlan_abd, msp_abd
-    )  # only run once for each cohort!
 
-    # reload the res from file
-    res_reload = load_msp_metaphlan_LM(full_res_sfp)
-    # get the best metaphlan_spp for each msp_id according to the r2 values
-    res_best_R2 = {}
-    for item in res_reload:
-        metaphlan_spp, msp_id = item
-        coefficients, interceptions, MSE, r2 = res_reload[item]
-        if msp_id not in res_best_R2:
-            res_best_R2[msp_id] = [None, None, None, None]  # as a pseudo-min
-        if res_best_R2[msp_id][-1] == None:
-            res_best_R2[msp_id] = [metaphlan_spp, coefficients, interceptions, MSE, r2]
-            continue
-        if res_best_R2[msp_id][-1] < r2:
-            res_best_R2[msp_id] = [metaphlan_spp, coefficients, interceptions, MSE, r2]
-            continue
-    # save the best match of each MSP
-
-    with open(bestR2_res_sfp, "w") as sf:
-        sf.write(
-            "\t".join(
-                [
-                    "msp_id",
-                    "metaphlan_spp",
-                    "coefficients",
-                    "interceptions",
-                    "MSE",
-                    "r2",
-                ]
+    sample_id_lst, msp_mat, spp_mat = _align_samples(
+        msp_sample_id_lst, msp_mat, metaphlan_sample_id_lst, spp_mat
+    )
+    print("N samples: ", len(sample_id_lst))
+    if len(msp_id_lst) == 0 or len(spp_lst) == 0 or len(sample_id_lst) == 0:
+        raise ValueError(
+            "Nothing to fit: {0} MSPs and {1} species over {2} shared samples.".format(
+                len(msp_id_lst), len(spp_lst), len(sample_id_lst)
             )
-            + "\n"
         )
-        cur_msp_id_lst = list(res_best_R2.keys())
-        cur_msp_id_lst.sort()
-        for cur_msp_id in cur_msp_id_lst:
-            cur_spp = res_best_R2[cur_msp_id][0]
-            sf.write(
-                "\t".join(
-                    [cur_msp_id, cur_spp]
-                    + [str(float(val)) for val in res_best_R2[cur_msp_id][1:]]
-                )
-                + "\n"
+
+    # score all against all with every metric, the best species are kept while scoring
+    best, full = score_all(
+        msp_mat,
+        spp_mat,
+        metrics=metrics,
+        top_k=top_k,
+        keep_full=full_table,
+        threads=threads,
+        memory_budget_mb=memory_budget_mb,
+        min_shared_samples=min_shared_samples,
+        min_prevalence=min_prevalence,
+        msp_pseudocount=msp_pseudocount,
+        spp_pseudocount=spp_pseudocount,
+        permutations=permutations,
+        seed=seed,
+    )  # only run once for each cohort!
+
+    # save the best match of each MSP per metric
+    # lm: msp_metaphlan_LM.bestR2.txt, others: msp_metaphlan_<metric>.best.txt
+    for metric in metrics:
+        fields = METRIC_FIELDS[metric]
+        best_fields = fields + (PERMUTATION_FIELDS if permutations > 0 else [])
+        metric_prefix = "{0}_{1}".format(res_prefix, METRIC_LABELS[metric])
+        best_sfp = metric_prefix + (".bestR2.txt" if metric == "lm" else ".best.txt")
+
+        n_unmatched = int(np.sum(best[metric]["spp_idx"][:, 0] >= len(spp_lst)))
+        if n_unmatched > 0:
+            print(
+                "N MSPs without candidate species (not saved, {0}): ".format(metric),
+                n_unmatched,
+            )
+
+        best_1 = {key: val[:, :1] for key, val in best[metric].items()}
+        _save_best_LM(best_sfp, msp_id_lst, spp_lst, best_1, fields=best_fields)
+        if top_k > 1:
+            _save_best_LM(
+                metric_prefix + ".top{0}.txt".format(top_k),
+                msp_id_lst,
+                spp_lst,
+                best[metric],
+                with_rank=True,
+                fields=best_fields,
+            )
+        if full_table:
+            _save_full_LM(
+                metric_prefix + ".full.npz",
+                msp_id_lst,
+                spp_lst,
+                full[metric],
+                fields=fields,
             )
     return  # done
 
@@ -296,12 +882,97 @@ def _msp_taxaANN_metaphlanLM(
     default="v3",
     help="MetaPhlAn version (affects output filenames, default: v3)",
 )
-def main(msp_profile, metaphlan_profile, output_dir, metaphlan_version):
+@click.option(
+    "--top-k",
+    type=int,
+    default=1,
+    help="Number of best species kept per MSP; above 1 they are also saved to *_LM.top<k>.txt (default: 1)",
+)
+@click.option(
+    "--full-table/--no-full-table",
+    default=False,
+    help="Also save all MSP x species fits to *_LM.full.npz (default: off)",
+)
+@click.option(
+    "--threads",
+    type=int,
+    default=1,
+    help="Number of worker processes scoring MSP x species tiles (default: 1)",
+)
+@click.option(
+    "--memory-budget",
+    type=int,
+    default=2048,
+    help="Memory in MB shared by the workers for scoring tiles, sets the tile size (default: 2048)",
+)
+@click.option(
+    "--min-shared-samples",
+    type=int,
+    default=0,
+    help="Only fit MSP-species pairs that are both non-zero in at least this many samples (default: 0, all pairs)",
+)
+@click.option(
+    "--min-prevalence",
+    type=float,
+    default=0.0,
+    help="Only fit species that are non-zero in at least this fraction of the samples (default: 0, all species)",
+)
+@click.option(
+    "--metric",
+    "metrics",
+    type=click.Choice(list(METRIC_FIELDS)),
+    multiple=True,
+    default=["lm"],
+    help="Association metric scored in the same pass, repeat the option for several (default: lm)",
+)
+@click.option(
+    "--msp-pseudocount",
+    type=float,
+    default=None,
+    help="Pseudocount of the MSP abundances for the log metric (default: half of the smallest non-zero abundance of the MSP table)",
+)
+@click.option(
+    "--species-pseudocount",
+    "spp_pseudocount",
+    type=float,
+    default=None,
+    help="Pseudocount of the MetaPhlAn abundances for the log metric (default: half of the smallest non-zero abundance of the MetaPhlAn table)",
+)
+@click.option(
+    "--permutations",
+    type=int,
+    default=0,
+    help="Number of sample permutations of the species profiles for empirical p-values of the best matches; every permutation rescores all MSP-species tiles, so the run takes about N + 1 times as long (default: 0, none)",
+)
+@click.option(
+    "--seed",
+    type=int,
+    default=0,
+    help="Random seed of the permutations (default: 0)",
+)
+def main(
+    msp_profile,
+    metaphlan_profile,
+    output_dir,
+    metaphlan_version,
+    top_k,
+    full_table,
+    threads,
+    memory_budget,
+    min_shared_samples,
+    min_prevalence,
+    metrics,
+    msp_pseudocount,
+    spp_pseudocount,
+    permutations,
+    seed,
+):
     """
     Perform taxonomic annotation of MSPs using MetaPhlAn profiles through linear regression analysis.
 
     This tool performs linear regression between MSP abundance profiles and MetaPhlAn species
-    abundance profiles to find the best taxonomic matches for each MSP.
+    abundance profiles to find the best taxonomic matches for each MSP. Pearson, Spearman
+    and log-space correlations can be scored in the same pass (--metric).
     """
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
@@ -314,7 +985,21 @@ def main(msp_profile, metaphlan_profile, output_dir, metaphlan_version):
     click.echo(f"MetaPhlAn version: {metaphlan_version}")
 
     _msp_taxaANN_metaphlanLM(
-        output_dir, msp_profile, metaphlan_profile, metaphlan_version
+        output_dir,
+        msp_profile,
+        metaphlan_profile,
+        metaphlan_version,
+        top_k=top_k,
+        full_table=full_table,
+        threads=threads,
+        memory_budget_mb=memory_budget,
+        min_shared_samples=min_shared_samples,
+        min_prevalence=min_prevalence,
+        metrics=list(dict.fromkeys(metrics)),
+        msp_pseudocount=msp_pseudocount,
+        spp_pseudocount=spp_pseudocount,
+        permutations=permutations,
+        seed=seed,
     )
 
     click.echo("Analysis completed successfully!")
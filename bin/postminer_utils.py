@@ -1,15 +1,23 @@
 #!/usr/bin/env python
 import click
+import hashlib
+import json
+import numpy as np
 import pandas as pd
-from collections import defaultdict
+from collections import OrderedDict
 import os
-from pyfaidx import Fasta, FetchError
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 from sklearn import datasets, linear_model
 from sklearn.metrics import mean_squared_error, r2_score
 
+from catalog_index import CatalogIndex, build_catalog_index
+from fasta_stream import header_id, iter_batches, read_fasta
+from gene_id_codec import GeneIdCodec, codec_path
+from gene_matrix import GeneMatrix, is_gene_matrix
+
 
 @click.group("application")
 def main():
@@ -25,154 +33,608 @@ def helper():
     pass
 
 
+MEMBERSHIP_SUFFIX = ".membership.npz"
+
+
+def _pack_strings(str_lst):
+    return np.frombuffer("\n".join(str_lst).encode(), dtype=np.uint8)
+
+
+def _unpack_strings(packed):
+    if packed.size == 0:
+        return np.array([], dtype=object)
+    return np.array(packed.tobytes().decode().split("\n"), dtype=object)
+
+
+class MspMembership:
+    """
+    MSP gene membership from all_msps.tsv in compressed sparse row form.
+
+    Memberships are grouped by MSP, keeping the file order within each MSP, and
+    genes and categories are dictionary-encoded to integers:
+
+    - msp_ids[i]: name of MSP i, its memberships are indptr[i]:indptr[i + 1]
+    - gene_codes: position in gene_ids of the gene of each membership
+    - category_codes: position in categories of the gene_category of each membership
+    """
+
+    def __init__(
+        self, msp_ids, gene_ids, categories, indptr, gene_codes, category_codes
+    ):
+        self.msp_ids = msp_ids
+        self.gene_ids = gene_ids
+        self.categories = categories
+        self.indptr = indptr
+        self.gene_codes = gene_codes
+        self.category_codes = category_codes
+        self._gene_index = None
+
+    @classmethod
+    def from_tsv(cls, all_msps_fp):
+        df = pd.read_csv(
+            all_msps_fp,
+            sep="\t",
+            usecols=["msp_name", "gene_category", "gene_name"],
+            dtype="category",
+        )
+        msp_codes, msp_ids = pd.factorize(df["msp_name"], sort=True)
+        gene_codes, gene_ids = pd.factorize(df["gene_name"])
+        category_codes, categories = pd.factorize(df["gene_category"], sort=True)
+        del df
+
+        order = np.argsort(msp_codes, kind="stable")
+        indptr = np.zeros(len(msp_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(msp_codes, minlength=len(msp_ids)), out=indptr[1:])
+
+        return cls(
+            np.asarray(msp_ids, dtype=object),
+            np.asarray(gene_ids, dtype=object),
+            np.asarray(categories, dtype=object),
+            indptr,
+            gene_codes[order].astype(np.int32),
+            category_codes[order].astype(np.int8),
+        )
+
+    @classmethod
+    def load(cls, membership_fp):
+        with np.load(membership_fp) as data:
+            return cls(
+                _unpack_strings(data["msp_ids"]),
+                _unpack_strings(data["gene_ids"]),
+                _unpack_strings(data["categories"]),
+                data["indptr"],
+                data["gene_codes"],
+                data["category_codes"],
+            )
+
+    def save(self, membership_fp):
+        np.savez(
+            membership_fp,
+            msp_ids=_pack_strings(self.msp_ids),
+            gene_ids=_pack_strings(self.gene_ids),
+            categories=_pack_strings(self.categories),
+            indptr=self.indptr,
+            gene_codes=self.gene_codes,
+            category_codes=self.category_codes,
+        )
+
+    @property
+    def gene_index(self):
+        """pandas.Index over gene_ids, for bulk gene name -> code lookups."""
+        if self._gene_index is None:
+            self._gene_index = pd.Index(self.gene_ids)
+        return self._gene_index
+
+    def category_mask(self, sel_category):
+        """Boolean mask over the memberships of the selected gene categories."""
+        sel_codes = [
+            ii for ii, it in enumerate(self.categories) if it in set(sel_category)
+        ]
+        return np.isin(self.category_codes, sel_codes)
+
+    def msp_genes(self, msp_idx, mask=None):
+        """Gene codes of one MSP, optionally restricted to a membership mask."""
+        start, end = self.indptr[msp_idx], self.indptr[msp_idx + 1]
+        gene_codes = self.gene_codes[start:end]
+        if mask is not None:
+            gene_codes = gene_codes[mask[start:end]]
+        return gene_codes
+
+    def membership_msp_codes(self):
+        """MSP index of every membership."""
+        return np.repeat(np.arange(len(self.msp_ids)), np.diff(self.indptr))
+
+    def selected_msps(self, mask):
+        """Indices of the MSPs that have at least one membership in the mask."""
+        counts = np.bincount(
+            self.membership_msp_codes()[mask], minlength=len(self.msp_ids)
+        )
+        return np.flatnonzero(counts)
+
+    def gene_dict(self, sel_category):
+        """Mapping of msp_name -> list of gene names of the selected categories."""
+        mask = self.category_mask(sel_category)
+        return {
+            self.msp_ids[ii]: list(self.gene_ids[self.msp_genes(ii, mask)])
+            for ii in self.selected_msps(mask)
+        }
+
+
+def _load_msp_membership(all_msps_fp, membership_fp=None):
+    """
+    Load the MSP membership, using the integer-encoded cache next to all_msps.tsv.
+
+    A membership file built by build-msp-membership is loaded as given. Otherwise the
+    cache [all_msps.tsv.membership.npz] is written on first use and rebuilt when
+    all_msps.tsv is newer than it; this only helps repeated standalone CLI runs, in
+    the pipeline every task stages its inputs in a new work directory, so the
+    membership is built once by MSP_MEMBERSHIP and passed on instead.
+
+    Parameters:
+    - all_msps_fp (str): Path to the input TSV file "all_msps.tsv".
+    - membership_fp (str): Optional membership file [.membership.npz].
+
+    Returns:
+    - MspMembership: CSR-encoded MSP gene membership.
+    """
+    if membership_fp:
+        return MspMembership.load(membership_fp)
+
+    membership_fp = str(all_msps_fp) + MEMBERSHIP_SUFFIX
+    if os.path.isfile(membership_fp) and os.path.getmtime(
+        membership_fp
+    ) >= os.path.getmtime(all_msps_fp):
+        return MspMembership.load(membership_fp)
+
+    membership = MspMembership.from_tsv(all_msps_fp)
+    try:
+        membership.save(membership_fp)
+    except OSError as e:
+        print("[Warning] could not cache the MSP membership: {0}".format(e))
+    return membership
+
+
 def _load_msp_gc_id(
     all_msps_fp, sel_category={"core", "accessory", "shared_core", "shared_accessory"}
 ):
     """
-    Load gene_id lists for each msp_name, filtered by gene_category == 'core'.
+    Load gene_id lists for each msp_name, filtered by gene_category.
 
     Parameters:
     - all_msps_fp (str): Path to the input TSV file "all_msps.tsv".
+    - sel_category (set): gene categories to keep.
 
     Returns:
-    - dict: Mapping of msp_name -> list of core gene_ids.
+    - dict: Mapping of msp_name -> list of gene_ids.
     """
-    # Read only necessary columns
-    df = pd.read_csv(
-        all_msps_fp,
-        sep="\t",
-        usecols=["msp_name", "gene_category", "gene_id", "gene_name"],
-    )
+    return _load_msp_membership(all_msps_fp).gene_dict(sel_category)
+
 
-    # Filter the selected category
-    sel_df = df[df["gene_category"].isin(sel_category)]
+def _extract_fasta_by_ids(catalog_index, header_ids, output_path):
+    """
+    Extract sequences from the gene catalog by header ID through its catalog index.
+
+    Parameters:
+    - catalog_index (CatalogIndex): Opened index of the gene catalog (see catalog_index.py).
+    - header_ids (list or set): Sequence IDs to extract.
+    - output_path (str or Path): File to write extracted sequences, in catalog order.
+    """
+    records, missing = catalog_index.fetch(header_ids)
 
-    # Group by msp_name and aggregate gene_id into lists
-    gene_dict = sel_df.groupby("msp_name")["gene_name"].apply(list).to_dict()
+    with open(output_path, "w") as out_f:
+        for seq_id, seq in records:
+            out_f.write(f">{seq_id}\n{seq}\n")
 
-    return gene_dict
+    for seq_id in missing:
+        print(f"[Warning] ID not found: {seq_id}")
 
 
-def _calculate_sample_means(
-    data_file, id_list, output_file=None, sep="\t", chunk_size=500000
+class _OutputHandlePool:
+    """
+    Bounded pool of open output files in append mode.
+
+    When the pool is full the least recently used handle is closed, so thousands
+    of output files can be written without hitting the open file limit.
+    """
+
+    def __init__(self, max_open_files=256):
+        self.max_open_files = max_open_files
+        self.handles = OrderedDict()
+
+    def write(self, output_path, text):
+        handle = self.handles.get(output_path)
+        if handle is None:
+            if len(self.handles) >= self.max_open_files:
+                _, lru_handle = self.handles.popitem(last=False)
+                lru_handle.close()
+            handle = open(output_path, "a")
+            self.handles[output_path] = handle
+        else:
+            self.handles.move_to_end(output_path)
+        handle.write(text)
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _scatter_fasta_by_msp(
+    fasta_path,
+    membership,
+    sel_category,
+    output_dir,
+    max_open_files=256,
+    batch_size=100000,
+):
+    """
+    Write the pangenome sequences of all MSPs with one sequential pass over the gene catalog.
+
+    Every catalog record is routed to the file of each MSP it belongs to, so the
+    records of an MSP file follow the catalog order.
+
+    Parameters:
+    - fasta_path (str or Path): Path to the gene catalog FASTA file (plain or gzipped).
+    - membership (MspMembership): MSP gene membership.
+    - sel_category (set): gene categories to write.
+    - output_dir (str or Path): Folder for the [msp_id+.pangenome.fasta] files.
+    - max_open_files (int): Maximum number of output files open at the same time.
+    - batch_size (int): Number of catalog records looked up at once.
+    """
+    mask = membership.category_mask(sel_category)
+    output_fp_dic = {
+        msp_idx: os.path.join(output_dir, membership.msp_ids[msp_idx] + ".pangenome.fasta")
+        for msp_idx in membership.selected_msps(mask)
+    }
+
+    # (gene, msp) pairs sorted by gene, gene_ptr gives the MSPs of each gene code
+    gene_msp_pairs = np.unique(
+        np.column_stack(
+            [membership.gene_codes[mask], membership.membership_msp_codes()[mask]]
+        ),
+        axis=0,
+    )
+    gene_ptr = np.searchsorted(
+        gene_msp_pairs[:, 0], np.arange(len(membership.gene_ids) + 1)
+    )
+    pair_msp_codes = gene_msp_pairs[:, 1]
+    n_genes = np.count_nonzero(np.diff(gene_ptr))
+
+    # create every file, also for MSPs without sequences in the catalog
+    for output_fp in output_fp_dic.values():
+        open(output_fp, "w").close()
+
+    n_found = 0
+    with _OutputHandlePool(max_open_files) as handle_pool:
+        for batch in iter_batches(read_fasta(fasta_path), batch_size):
+            seq_ids = [header_id(header).decode() for header, _ in batch]
+            gene_codes = membership.gene_index.get_indexer(seq_ids)
+            for seq_id, (_, seq), gene_code in zip(seq_ids, batch, gene_codes):
+                if gene_code < 0:
+                    continue
+                start, end = gene_ptr[gene_code], gene_ptr[gene_code + 1]
+                if start == end:
+                    continue
+                n_found += 1
+                record = ">{0}\n{1}\n".format(seq_id, seq.decode())
+                for msp_idx in pair_msp_codes[start:end]:
+                    handle_pool.write(output_fp_dic[msp_idx], record)
+
+    if n_found < n_genes:
+        print(
+            "[Warning] {0} of {1} genes not found in the catalog".format(
+                n_genes - n_found, n_genes
+            )
+        )
+
+
+def _read_sample_ids(data_file, sep="\t"):
+    """Return the sample (column) names of a gene abundance table, TSV or .npy."""
+    if is_gene_matrix(data_file):
+        return GeneMatrix(data_file).sample_ids
+    return list(pd.read_csv(data_file, sep=sep, index_col=0, nrows=0).columns)
+
+
+def _collect_gene_rows(
+    data_file,
+    gene_ids,
+    sep="\t",
+    chunk_size=500000,
+    exclude_samples=None,
+    codec=None,
 ):
     """
-    Calculate column-wise means for selected rows from a large file.
+    Scan a large gene abundance table once and keep the rows of the selected genes.
+
+    A binary gene matrix (see gene_matrix.py) is read by gathering only the selected
+    rows from the memory-mapped values instead of parsing the text table.
 
     Parameters:
-    - data_file (str): Path to the large data file.
-    - id_list (list or set): List or set of row IDs to extract.
-    - output_file (str): Optional path to write the result.
+    - data_file (str): Path to the gene abundance table (genes x samples), TSV or .npy.
+    - gene_ids (set): Row IDs to keep.
     - sep (str): Field separator (default: tab-delimited).
-    - chunk_size (int): Use chunks to handle large files, adjust based on memory
+    - chunk_size (int): Chunk size for reading large files.
+    - exclude_samples (set): Optional sample columns to skip, they are not parsed.
+    - codec (GeneIdCodec): Optional gene ID codec; gene_ids are then catalog codes
+      (numpy array) and row_ids are returned as codes, so no gene name set is built.
 
     Returns:
-    - pandas.Series: Mean values for each column (sample).
+    - tuple: (row_ids, values, sample_ids) where values is a float64 array holding
+      the kept rows in file order.
     """
-    # Convert ID list to set for fast lookup
-    target_ids = set(id_list)
+    all_sample_ids = _read_sample_ids(data_file, sep=sep)
+    exclude_samples = exclude_samples or set()
+    sample_pos = [
+        ii for ii, it in enumerate(all_sample_ids) if it not in exclude_samples
+    ]
+    sample_ids = [all_sample_ids[ii] for ii in sample_pos]
+
+    if is_gene_matrix(data_file):
+        gene_matrix = GeneMatrix(data_file)
+        if codec is None:
+            row_ids, values = gene_matrix.gather(gene_ids, columns=sample_pos)
+        else:
+            row_ids, values = gene_matrix.gather(
+                set(codec.decode(gene_ids)), columns=sample_pos
+            )
+            row_ids = codec.encode(row_ids)
+        print("{0} of {1} rows kept".format(len(row_ids), gene_matrix.shape[0]))
+        return row_ids, values, sample_ids
+
+    row_ids = []
+    blocks = []
+
+    # the first column holds the gene IDs, the others are the selected samples
+    chunks = pd.read_csv(
+        data_file,
+        sep=sep,
+        index_col=0,
+        usecols=[0] + [ii + 1 for ii in sample_pos],
+        chunksize=chunk_size,
+    )
+
+    for ii, chunk in enumerate(chunks):
+        if codec is None:
+            keep = chunk.index.isin(gene_ids)
+        else:
+            chunk_codes = codec.encode(chunk.index.astype(str))
+            keep = np.isin(chunk_codes, gene_ids)
+        filtered = chunk[keep]
+        # not filtered.empty: without sample columns the frame is empty but has rows
+        if len(filtered) > 0:
+            if codec is None:
+                row_ids.extend(filtered.index)
+            else:
+                row_ids.extend(chunk_codes[keep].tolist())
+            blocks.append(filtered.to_numpy(dtype=np.float64))
+        print("chunk {0}: {1} rows kept".format(ii, len(row_ids)))
 
-    # Use chunks to handle large files
+    if blocks:
+        values = np.concatenate(blocks)
+    else:
+        values = np.empty((0, len(sample_ids)))
 
-    chunks = pd.read_csv(data_file, sep=sep, index_col=0, chunksize=chunk_size)
+    return row_ids, values, sample_ids
 
-    mean_sum = None
-    count = 0
 
-    for chunk in chunks:
-        # Filter rows by target IDs
-        filtered = chunk[chunk.index.isin(target_ids)]
-        if not filtered.empty:
-            if mean_sum is None:
-                mean_sum = filtered.sum()
-            else:
-                mean_sum += filtered.sum()
-            count += len(filtered)
+def _summarize_msp_rows(values, msp_rows, method="median"):
+    """
+    Aggregate gene rows into one abundance row per MSP.
+
+    Parameters:
+    - values (numpy.ndarray): Gene x sample abundance values.
+    - msp_rows (list): For each MSP, the row indices of its genes in values.
+    - method (str): median or mean.
+
+    Returns:
+    - numpy.ndarray: MSP x sample abundance values.
+    """
+    msp_abd = np.empty((len(msp_rows), values.shape[1]))
+    for ii, rows in enumerate(msp_rows):
+        cur_values = values[rows]
+        if method == "median":
+            msp_abd[ii] = np.nanmedian(cur_values, axis=0)
+        else:
+            # same as the pandas sum (NaN skipped) divided by the number of genes;
+            # each sample is summed as its own contiguous row, so the result does
+            # not depend on how the sample columns are split into blocks
+            cur_values = np.ascontiguousarray(cur_values.T)
+            msp_abd[ii] = np.nansum(cur_values, axis=1) / len(rows)
+    return msp_abd
+
+
+# shared by the worker processes of _summarize_msp_rows_parallel
+_block_args = None
+
+
+def _init_block_worker(values, msp_rows, method):
+    global _block_args
+    _block_args = (values, msp_rows, method)
+
 
-    if count == 0:
-        raise ValueError("No matching IDs found in the file.")
+def _summarize_msp_block(bounds):
+    values, msp_rows, method = _block_args
+    start, end = bounds
+    return _summarize_msp_rows(values[:, start:end], msp_rows, method)
 
-    mean_values = mean_sum / count
 
-    if output_file:
-        mean_values.to_csv(output_file, sep=sep)
+def _summarize_msp_rows_parallel(values, msp_rows, method="median", threads=1):
+    """
+    Aggregate gene rows into MSP abundances with the sample columns split over a process pool.
 
-    return mean_values
+    Every sample column is summarised independently, so the stitched result is
+    identical to _summarize_msp_rows on the full matrix.
 
+    Parameters:
+    - values (numpy.ndarray): Gene x sample abundance values.
+    - msp_rows (list): For each MSP, the row indices of its genes in values.
+    - method (str): median or mean.
+    - threads (int): Number of worker processes.
 
-def _calculate_sample_medians(
-    data_file, id_list, output_file=None, sep="\t", chunk_size=5000000
+    Returns:
+    - numpy.ndarray: MSP x sample abundance values.
+    """
+    n_samples = values.shape[1]
+    if threads <= 1 or n_samples < 2:
+        return _summarize_msp_rows(values, msp_rows, method)
+
+    # a few blocks per worker keeps the pool busy when blocks take uneven time
+    n_blocks = min(n_samples, threads * 4)
+    edges = np.linspace(0, n_samples, n_blocks + 1).astype(int)
+    block_bounds = [(start, end) for start, end in zip(edges[:-1], edges[1:])]
+
+    # forked workers share the gathered values instead of receiving a pickled copy
+    with ProcessPoolExecutor(
+        max_workers=threads,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_block_worker,
+        initargs=(values, msp_rows, method),
+    ) as executor:
+        blocks = list(executor.map(_summarize_msp_block, block_bounds))
+
+    return np.hstack(blocks)
+
+
+def _calculate_msp_abundance(
+    data_file,
+    membership,
+    sel_category={"core"},
+    method="median",
+    sep="\t",
+    chunk_size=500000,
+    threads=1,
+    exclude_samples=None,
+    codec=None,
 ):
     """
-    Calculate column-wise medians for selected rows from a large file.
+    Calculate the abundance of every MSP with a single pass over the gene abundance table.
 
     Parameters:
-    - data_file (str): Path to the large data file.
-    - id_list (list or set): List or set of row IDs to extract.
-    - output_file (str): Optional path to write the result.
+    - data_file (str): Path to the gene abundance table (genes x samples).
+    - membership (MspMembership): MSP gene membership.
+    - sel_category (set): gene categories used for the abundance.
+    - method (str): median or mean of the gene abundances.
     - sep (str): Field separator (default: tab-delimited).
     - chunk_size (int): Chunk size for reading large files.
+    - threads (int): Number of worker processes for the per-sample statistics.
+    - exclude_samples (set): Optional samples to leave out, e.g. already computed ones.
+    - codec (GeneIdCodec): Optional gene ID codec, gene rows are then matched by catalog code.
 
     Returns:
-    - pandas.Series: Median values for each column (sample).
+    - pandas.DataFrame: MSP x sample abundance table, MSPs sorted by name.
     """
-    target_ids = set(id_list)
-    collected_rows = []
+    mask = membership.category_mask(sel_category)
+    msp_idx_lst = membership.selected_msps(mask)
+    target_codes = np.unique(membership.gene_codes[mask])
+    if codec is None:
+        target_ids = set(membership.gene_ids[target_codes])
+    else:
+        # all_msps.tsv genes missing from the catalog encode to -1 and are skipped,
+        # like genes missing from the abundance table without a codec
+        member_codes = codec.encode(membership.gene_ids)
+        target_ids = member_codes[target_codes]
+        target_ids = target_ids[target_ids >= 0]
+
+    row_ids, values, sample_ids = _collect_gene_rows(
+        data_file,
+        target_ids,
+        sep=sep,
+        chunk_size=chunk_size,
+        exclude_samples=exclude_samples,
+        codec=codec,
+    )
 
-    chunks = pd.read_csv(data_file, sep=sep, index_col=0, chunksize=chunk_size)
+    # gene code -> row in values, used to route the genes of each MSP
+    if codec is None:
+        gene_row = np.full(len(membership.gene_ids), -1, dtype=np.int64)
+        gene_row[membership.gene_index.get_indexer(row_ids)] = np.arange(len(row_ids))
+    else:
+        catalog_row = np.full(len(codec), -1, dtype=np.int64)
+        catalog_row[np.asarray(row_ids, dtype=np.int64)] = np.arange(len(row_ids))
+        gene_row = np.where(member_codes >= 0, catalog_row[member_codes], -1)
+    msp_rows = []
+    for msp_idx in msp_idx_lst:
+        rows = np.unique(gene_row[membership.msp_genes(msp_idx, mask)])
+        rows = rows[rows >= 0]
+        if rows.size == 0:
+            raise ValueError(
+                "No matching IDs found in the file for {0}.".format(
+                    membership.msp_ids[msp_idx]
+                )
+            )
+        msp_rows.append(rows)
 
-    for chunk in chunks:
-        filtered = chunk[chunk.index.isin(target_ids)]
-        if not filtered.empty:
-            collected_rows.append(filtered)
+    msp_abd = _summarize_msp_rows_parallel(values, msp_rows, method, threads)
 
-    if not collected_rows:
-        raise ValueError("No matching IDs found in the file.")
+    return pd.DataFrame(
+        msp_abd, index=list(membership.msp_ids[msp_idx_lst]), columns=sample_ids
+    )
 
-    # Concatenate all collected rows
-    all_data = pd.concat(collected_rows)
 
-    # Compute column-wise median
-    median_values = all_data.median(axis=0)
+def _membership_fingerprint(membership, sel_category, method):
+    """
+    Fingerprint of the MSP gene membership behind an MSP abundance table.
+
+    The sorted gene names of every selected MSP are hashed together with the MSP
+    name and the abundance method, independent of the order in all_msps.tsv.
+    """
+    mask = membership.category_mask(sel_category)
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(method.encode())
+    for msp_idx in membership.selected_msps(mask):
+        gene_lst = sorted(membership.gene_ids[membership.msp_genes(msp_idx, mask)])
+        hasher.update(("\n>" + membership.msp_ids[msp_idx] + "\n").encode())
+        hasher.update("\n".join(gene_lst).encode())
+    return hasher.hexdigest()
 
-    if output_file:
-        median_values.to_csv(output_file, sep=sep)
 
-    return median_values
+def _abundance_meta_fp(abundance_fp):
+    return str(abundance_fp) + ".meta.json"
 
 
-def _extract_fasta_by_ids(fasta_path, header_ids, output_path, threads=20):
+def _load_previous_abundance(previous_abd_fp, membership_fp_hash, method):
     """
-    Efficiently extract sequences from a FASTA file by header ID using multithreading.
+    Load an earlier MSP abundance table and check that it used the same MSPs and method.
 
     Parameters:
-    - fasta_path (str or Path): Path to the input FASTA file.
-    - header_ids (list or set): Sequence IDs to extract.
-    - output_path (str or Path): File to write extracted sequences.
-    - threads (int): Number of threads to use.
-    """
-    fasta = Fasta(fasta_path, rebuild=False, as_raw=True)
-    header_ids = list(set(header_ids))  # Remove duplicates and allow indexing
-
-    def fetch_record(seq_id):
-        try:
-            seq = fasta[seq_id]
-            return f">{seq.name}\n{str(seq)}\n"
-        except FetchError:
-            return f"[Warning] ID not found: {seq_id}\n"
-
-    with ThreadPoolExecutor(max_workers=threads) as executor:
-        futures = {
-            executor.submit(fetch_record, seq_id): seq_id for seq_id in header_ids
-        }
+    - previous_abd_fp (str): MSP abundance table written by get-msp-abd.
+    - membership_fp_hash (str): Fingerprint of the current MSP membership.
+    - method (str): median or mean.
 
-        with open(output_path, "w") as out_f:
-            for future in as_completed(futures):
-                record = future.result()
-                if not record.startswith("[Warning]"):
-                    out_f.write(record)
-                else:
-                    print(record.strip())
+    Returns:
+    - pandas.DataFrame: The earlier MSP x sample abundance table.
+    """
+    meta_fp = _abundance_meta_fp(previous_abd_fp)
+    if not os.path.isfile(meta_fp):
+        raise ValueError(
+            "{0} not found, the MSP membership of the previous run cannot be checked.".format(
+                meta_fp
+            )
+        )
+    with open(meta_fp, "r") as f:
+        previous_meta = json.load(f)
+
+    if previous_meta["method"] != method:
+        raise ValueError(
+            "previous run used method {0}, not {1}".format(
+                previous_meta["method"], method
+            )
+        )
+    if previous_meta["membership_fingerprint"] != membership_fp_hash:
+        raise ValueError(
+            "MSP gene membership differs from the previous run, recompute all samples."
+        )
+
+    # round_trip keeps the earlier values bit-identical when they are written again
+    return pd.read_csv(
+        previous_abd_fp, sep="\t", index_col=0, float_precision="round_trip"
+    )
 
 
 # use the median value of core genes to estimate the abundance of each MSPminer
@@ -181,7 +643,7 @@ def _extract_fasta_by_ids(fasta_path, header_ids, output_path, threads=20):
     "--rpkm-fp",
     default=False,
     type=str,
-    help="file path to the gene abundance file [rpkm]",
+    help="file path to the gene abundance file [rpkm], TSV or binary matrix [.npy]",
 )
 @click.option(
     "--all-msps-fp",
@@ -196,45 +658,96 @@ def _extract_fasta_by_ids(fasta_path, header_ids, output_path, threads=20):
     type=str,
     help="method for MSP abundance cacluation: [median or mean] or core genes",
 )
-def get_msp_abd(rpkm_fp, all_msps_fp, save_fp, method):
+@click.option(
+    "--threads",
+    "--workers",
+    default=1,
+    type=int,
+    help="number of worker processes, the sample columns are split between them",
+)
+@click.option(
+    "--previous-abd-fp",
+    default=None,
+    type=str,
+    help="MSP abundance table of an earlier run with the same all_msps.tsv; only samples missing from it are computed and appended",
+)
+@click.option(
+    "--id-codec",
+    default=None,
+    type=str,
+    help="gene ID codec of the gene catalog [.ids.npz, see build-id-codec]; gene rows are matched by int32 code",
+)
+@click.option(
+    "--msp-membership-fp",
+    default=None,
+    type=str,
+    help="MSP membership of all_msps.tsv [.membership.npz, see build-msp-membership]; all_msps.tsv is then not parsed",
+)
+def get_msp_abd(
+    rpkm_fp,
+    all_msps_fp,
+    save_fp,
+    method,
+    threads,
+    previous_abd_fp,
+    id_codec,
+    msp_membership_fp,
+):
     # check if input method is valid
     if method not in {"median", "mean"}:
         print("invalid method: {0}, please select from [median or mean]".format(method))
         return
 
-    core_gene_dic = _load_msp_gc_id(all_msps_fp, sel_category={"core"})
-    msp_id_lst = list(core_gene_dic.keys())
-    msp_id_lst.sort()
-
-    merged_abd = pd.DataFrame()
-    for ii, cur_msp_id in enumerate(msp_id_lst):
-        if ii % 100 == 0:
-            print(ii, round(100 * ii / len(msp_id_lst)))
-        # cur_abd: a Series or single-column DataFrame with sample IDs as index
-        if method == "median":
-            cur_abd = _calculate_sample_medians(rpkm_fp, core_gene_dic[cur_msp_id])
-        elif method == "mean":
-            cur_abd = _calculate_sample_means(rpkm_fp, core_gene_dic[cur_msp_id])
-        else:
-            print(
-                "invalid method: {0}, please select from [median or mean]".format(
-                    method
-                )
-            )
-            return
-
-        # Ensure cur_abd is a Series and name it with msp_id
-        if isinstance(cur_abd, pd.DataFrame):
-            cur_abd = cur_abd.iloc[:, 0]
-        cur_abd.name = cur_msp_id
-
-        # Concatenate along columns (axis=1)
-        merged_abd = pd.concat([merged_abd, cur_abd], axis=1)
-
-    rotated_merged_abd = merged_abd.T
+    membership = _load_msp_membership(all_msps_fp, msp_membership_fp)
+    print("N MSPs: ", len(membership.msp_ids))
+    sel_category = {"core"}
+    membership_fp_hash = _membership_fingerprint(membership, sel_category, method)
+
+    previous_abd = None
+    if previous_abd_fp:
+        previous_abd = _load_previous_abundance(
+            previous_abd_fp, membership_fp_hash, method
+        )
+        print("N samples in the previous run: ", previous_abd.shape[1])
+        previous_samples = set(previous_abd.columns)
+        new_samples = [
+            it for it in _read_sample_ids(rpkm_fp) if it not in previous_samples
+        ]
+        print("N new samples: ", len(new_samples))
+
+    if previous_abd is not None and not new_samples:
+        # nothing to compute, the previous table is written out unchanged
+        msp_abd = previous_abd
+    else:
+        # one scan of the gene table for all MSPs, rows are MSPs and columns samples
+        msp_abd = _calculate_msp_abundance(
+            rpkm_fp,
+            membership,
+            sel_category,
+            method,
+            threads=threads,
+            exclude_samples=None if previous_abd is None else set(previous_abd.columns),
+            codec=GeneIdCodec.load(id_codec) if id_codec else None,
+        )
+        if previous_abd is not None:
+            if list(previous_abd.index) != list(msp_abd.index):
+                raise ValueError("MSPs of the previous run differ from all_msps.tsv")
+            msp_abd = pd.concat([previous_abd, msp_abd], axis=1)
 
     # Save to file, including row and column names
-    rotated_merged_abd.to_csv(save_fp, sep="\t", index=True, header=True)
+    msp_abd.to_csv(save_fp, sep="\t", index=True, header=True)
+    with open(_abundance_meta_fp(save_fp), "w") as f:
+        json.dump(
+            {
+                "method": method,
+                "gene_category": sorted(sel_category),
+                "membership_fingerprint": membership_fp_hash,
+                "n_msps": msp_abd.shape[0],
+                "n_samples": msp_abd.shape[1],
+            },
+            f,
+            indent=2,
+        )
     return
 
 
@@ -244,7 +757,7 @@ def get_msp_abd(rpkm_fp, all_msps_fp, save_fp, method):
     "--gene-catalog-fp",
     default=False,
     type=str,
-    help="file path to the gene catalog sequences [fasta]",
+    help="file path to the gene catalog sequences [fasta, BGZF-compressed fasta in index mode]",
 )
 @click.option(
     "--all-msps-fp",
@@ -258,19 +771,121 @@ def get_msp_abd(rpkm_fp, all_msps_fp, save_fp, method):
     type=str,
     help="folder to save the output pangenome files [msp_id+.pangenome.fasta]",
 )
-def get_msp_pangenome(gene_catalog_fp, all_msps_fp, msp_pangenome_dir):
-    all_gene_dic = _load_msp_gc_id(
-        all_msps_fp,
-        sel_category={"core", "accessory", "shared_core", "shared_accessory"},
-    )
-    msp_id_lst = list(all_gene_dic.keys())
-    msp_id_lst.sort()
-    for ii, cur_msp in enumerate(msp_id_lst):
-        if ii % 100 == 0:
-            print("{}%% done".format(round(100.0 * ii / len(msp_id_lst))))
-        cur_sfp = os.path.join(msp_pangenome_dir, cur_msp + ".pangenome.fasta")
-        cur_gc_lst = all_gene_dic[cur_msp]
-        _extract_fasta_by_ids(gene_catalog_fp, cur_gc_lst, cur_sfp)
+@click.option(
+    "--mode",
+    default="index",
+    type=click.Choice(["index", "scatter"]),
+    help="index: random access per MSP through the catalog index; scatter: one sequential pass over the catalog",
+)
+@click.option(
+    "--max-open-files",
+    default=256,
+    type=int,
+    help="maximum number of pangenome files kept open in scatter mode",
+)
+@click.option(
+    "--msp-membership-fp",
+    default=None,
+    type=str,
+    help="MSP membership of all_msps.tsv [.membership.npz, see build-msp-membership]; all_msps.tsv is then not parsed",
+)
+def get_msp_pangenome(
+    gene_catalog_fp,
+    all_msps_fp,
+    msp_pangenome_dir,
+    mode,
+    max_open_files,
+    msp_membership_fp,
+):
+    membership = _load_msp_membership(all_msps_fp, msp_membership_fp)
+    sel_category = {"core", "accessory", "shared_core", "shared_accessory"}
+    if mode == "scatter":
+        _scatter_fasta_by_msp(
+            gene_catalog_fp,
+            membership,
+            sel_category,
+            msp_pangenome_dir,
+            max_open_files,
+        )
+        return
+
+    mask = membership.category_mask(sel_category)
+    msp_idx_lst = membership.selected_msps(mask)
+    # the index is loaded once and shared by all MSPs
+    with CatalogIndex(gene_catalog_fp) as catalog_index:
+        for ii, msp_idx in enumerate(msp_idx_lst):
+            if ii % 100 == 0:
+                print("{}%% done".format(round(100.0 * ii / len(msp_idx_lst))))
+            cur_msp = membership.msp_ids[msp_idx]
+            cur_sfp = os.path.join(msp_pangenome_dir, cur_msp + ".pangenome.fasta")
+            cur_gc_lst = membership.gene_ids[membership.msp_genes(msp_idx, mask)]
+            _extract_fasta_by_ids(catalog_index, cur_gc_lst, cur_sfp)
+    return
+
+
+# build the catalog index once, so that later lookups do not need to scan the catalog
+@helper.command(name="build-catalog-index")
+@click.option(
+    "--gene-catalog-fp",
+    required=True,
+    type=str,
+    help="file path to the gene catalog sequences [fasta, plain or BGZF-compressed]",
+)
+@click.option(
+    "--index-fp",
+    default=None,
+    type=str,
+    help="path to save the index, default: [gene catalog path + .cidx.npy]",
+)
+def build_catalog_index_cmd(gene_catalog_fp, index_fp):
+    index_fp = build_catalog_index(gene_catalog_fp, index_fp)
+    print("catalog index saved to:", index_fp)
+    return
+
+
+# encode all_msps.tsv once, the membership is shared by the MSP helpers
+@helper.command(name="build-msp-membership")
+@click.option(
+    "--all-msps-fp",
+    required=True,
+    type=str,
+    help="file path to the major mspminer output file, default name: [all_msps.tsv]",
+)
+@click.option(
+    "--membership-fp",
+    default=None,
+    type=str,
+    help="path to save the membership, default: [all_msps.tsv path + .membership.npz]",
+)
+def build_msp_membership_cmd(all_msps_fp, membership_fp):
+    membership_fp = membership_fp or str(all_msps_fp) + MEMBERSHIP_SUFFIX
+    membership = MspMembership.from_tsv(all_msps_fp)
+    membership.save(membership_fp)
+    print("N MSPs: ", len(membership.msp_ids))
+    print("MSP membership saved to:", membership_fp)
+    return
+
+
+# number the catalog genes once, the codec is shared by the gene-level helpers
+@helper.command(name="build-id-codec")
+@click.option(
+    "--gene-catalog-fp",
+    required=True,
+    type=str,
+    help="file path to the gene catalog sequences [fasta, plain or gzip/BGZF-compressed]",
+)
+@click.option(
+    "--codec-fp",
+    default=None,
+    type=str,
+    help="path to save the codec, default: [gene catalog path + .ids.npz]",
+)
+def build_id_codec_cmd(gene_catalog_fp, codec_fp):
+    codec_fp = codec_fp or codec_path(gene_catalog_fp)
+    codec = GeneIdCodec.from_fasta(gene_catalog_fp)
+    codec.save(codec_fp)
+    print("N genes: ", len(codec))
+    print("ID codec saved to:", codec_fp)
     return
 
 
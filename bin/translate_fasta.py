@@ -1,12 +1,24 @@
 #! /usr/bin/env python
 
+import argparse
+import contextlib
+import hashlib
 import logging
 from typing import List
-import sys
 import tqdm
-from Bio import SeqIO
+import numpy as np
+from Bio.Data import CodonTable
 from Bio.Data.CodonTable import TranslationError
-from Bio.SeqRecord import SeqRecord
+from Bio.Seq import Seq
+
+from fasta_stream import (
+    format_fasta,
+    header_id,
+    iter_batches,
+    open_fasta_out,
+    ordered_pool_map,
+    read_fasta,
+)
 
 DEFAULT_TRANSLATION_TABLES = [11, 4]  # default translation table for microbiome data
 
@@ -41,35 +53,398 @@ DEFAULT_TRANSLATION_TABLES = [11, 4]  # default translation table for microbiome
 """
 
 
-def translate(fna: str, out: str, translation_tables: List[int]):
+BATCH_SIZE = 20000  # records translated at once by the lookup table engine
+
+# nucleotide byte -> 2-bit code, 4 for anything else (sequence goes to Biopython)
+_NT_CODE = np.full(256, 4, dtype=np.uint8)
+for _code, _nt in enumerate(b"ACGT"):
+    _NT_CODE[_nt] = _code
+    _NT_CODE[ord(chr(_nt).lower())] = _code
+
+_codon_lut_cache = {}
+
+
+def _codon_lut(translation_table: int):
+    """
+    Lookup tables over the 64 codons (code = 16 * nt1 + 4 * nt2 + nt3) of a genetic code.
+
+    Taken from the same Biopython codon table that Seq.translate uses, so both
+    engines agree on amino acids, start and stop codons.
+
+    Returns:
+    - tuple: (amino acid bytes as uint8, start codon mask, stop codon mask)
+    """
+    if translation_table not in _codon_lut_cache:
+        codon_table = CodonTable.ambiguous_generic_by_id[translation_table]
+        amino_acids = np.zeros(64, dtype=np.uint8)
+        is_start = np.zeros(64, dtype=bool)
+        is_stop = np.zeros(64, dtype=bool)
+        for code in range(64):
+            codon = "".join("ACGT"[(code >> shift) & 3] for shift in (4, 2, 0))
+            if codon in codon_table.forward_table:
+                amino_acids[code] = ord(codon_table.forward_table[codon])
+            is_start[code] = codon in codon_table.start_codons
+            is_stop[code] = codon in codon_table.stop_codons
+        _codon_lut_cache[translation_table] = (amino_acids, is_start, is_stop)
+    return _codon_lut_cache[translation_table]
+
+
+def _translate_biopython(seq: bytes, translation_tables: List[int]):
+    """Translate one CDS with Biopython, trying the tables in order; None if all fail."""
+    for translation_table in translation_tables:
+        try:
+            return str(
+                Seq(seq.decode()).translate(
+                    table=translation_table, stop_symbol="", cds=True
+                )
+            ).encode()
+        except TranslationError:
+            pass
+    return None
+
+
+def _translate_codons(codons, codon_starts, n_codons, translation_table: int):
+    """
+    Check and translate CDS given as codon codes with the lookup tables of one code.
+
+    Parameters:
+    - codons (numpy.ndarray): Codon codes of all sequences, one after the other.
+    - codon_starts (numpy.ndarray): Position in codons of the first codon of each sequence.
+    - n_codons (numpy.ndarray): Number of codons of each sequence (at least 2).
+    - translation_table (int): NCBI genetic code.
+
+    Returns:
+    - tuple: (mask of the valid CDS, amino acids of the valid CDS as one uint8 array,
+      their protein lengths)
+    """
+    amino_acids, is_start, is_stop = _codon_lut(translation_table)
+    first = codon_starts
+    last = codon_starts + n_codons - 1
+
+    # in-frame stops: stop codons of a sequence besides its final codon
+    stops = is_stop[codons]
+    n_stops = np.add.reduceat(stops, codon_starts)
+    valid = is_start[codons[first]] & stops[last] & (n_stops == 1)
+
+    # proteins: M for the start codon, no final stop codon
+    keep = np.repeat(valid, n_codons)
+    keep[last] = False
+    protein = amino_acids[codons]
+    protein[first] = ord("M")
+    return valid, protein[keep], n_codons[valid] - 1
+
+
+def translate_batch(seqs: List[bytes], translation_tables: List[int]):
+    """
+    Translate CDS like Biopython's translate(table, stop_symbol="", cds=True), trying
+    the tables in order: the start codon (translated as M), the final stop codon, no
+    in-frame stop codon and a length multiple of three are checked for the whole batch
+    at once. Sequences with other letters than ACGT, e.g. ambiguous bases, are
+    translated by Biopython.
+
+    Returns:
+    - list: protein sequence (bytes) of each sequence, None if no table translates it.
+    """
+    proteins = [None] * len(seqs)
+    lengths = np.fromiter((len(seq) for seq in seqs), dtype=np.int64, count=len(seqs))
+    nt = np.frombuffer(b"".join(seqs), dtype=np.uint8)
+    seq_starts = np.zeros(len(seqs), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=seq_starts[1:])
+
+    codes = _NT_CODE[nt]
+    # sequence of each non-ACGT byte, empty sequences own no bytes
+    other_pos = np.flatnonzero(codes == 4)
+    ambiguous = np.zeros(len(seqs), dtype=bool)
+    ambiguous[np.searchsorted(seq_starts, other_pos, side="right") - 1] = True
+    fast = ~ambiguous & (lengths % 3 == 0) & (lengths >= 6)
+
+    for idx in np.flatnonzero(ambiguous | (~fast & (lengths >= 3) & (lengths < 6))):
+        proteins[idx] = _translate_biopython(seqs[idx], translation_tables)
+
+    # codon codes of the sequences on the fast path
+    pending = np.flatnonzero(fast)
+    cds_mask = np.repeat(fast, lengths)
+    cds_codes = codes[cds_mask].reshape(-1, 3)
+    codons = (cds_codes[:, 0] << 4) | (cds_codes[:, 1] << 2) | cds_codes[:, 2]
+    n_codons = lengths[pending] // 3
+
+    for translation_table in translation_tables:
+        if len(pending) == 0:
+            break
+        codon_starts = np.zeros(len(pending), dtype=np.int64)
+        np.cumsum(n_codons[:-1], out=codon_starts[1:])
+        valid, protein, protein_lengths = _translate_codons(
+            codons, codon_starts, n_codons, translation_table
+        )
+        protein = protein.tobytes()
+        pos = 0
+        for idx, protein_length in zip(pending[valid].tolist(), protein_lengths.tolist()):
+            proteins[idx] = protein[pos : pos + protein_length]
+            pos += protein_length
+
+        # sequences that failed this table are tried with the next one
+        codons = codons[np.repeat(~valid, n_codons)]
+        pending = pending[~valid]
+        n_codons = n_codons[~valid]
+    return proteins
+
+
+def _translate_block(args):
+    """
+    Translate one batch of (header, sequence) records into FASTA bytes.
+
+    With with_digests, the records are returned one by one as (ID, FASTA record,
+    128-bit digest of the protein sequence), so that duplicates can be collapsed.
+
+    Returns:
+    - tuple: (protein FASTA block or records, IDs that failed with all tables,
+      number of records)
+    """
+    batch, translation_tables, with_digests = args
+    proteins = translate_batch([seq for _, seq in batch], translation_tables)
+    block = []
+    failed = []
+    for (header, _), protein in zip(batch, proteins):
+        seq_id = header_id(header)
+        if protein is None:
+            failed.append(seq_id.decode())
+            continue
+        if with_digests:
+            block.append(
+                (
+                    seq_id,
+                    format_fasta(seq_id, protein),
+                    hashlib.blake2b(protein, digest_size=16).digest(),
+                )
+            )
+        else:
+            block.append(format_fasta(seq_id, protein))
+    if with_digests:
+        return block, failed, len(batch)
+    return b"".join(block), failed, len(batch)
+
+
+class _ProteinRepresentatives:
+    """
+    Representative ID of every distinct protein, by protein digest, in numpy arrays.
+
+    The 128-bit digests are split in two uint64 words and kept in sorted runs by the
+    first word, with the representative numbers of the digests; two runs of similar
+    size are merged, so adding a batch costs O(batch x log(n)) amortized. IDs are
+    packed in one byte buffer. A distinct protein takes about 24 bytes plus its ID,
+    instead of the several hundred bytes of a dict of bytes keys and values.
+
+    In the unlikely case that two distinct proteins share the first word, the later
+    one is not found again and its duplicates stay representatives themselves.
+    """
+
+    def __init__(self):
+        self.runs = []  # [(sorted first words, second words, representative numbers)]
+        self.id_data = bytearray()
+        self.id_offsets = np.zeros(1024, dtype=np.int64)
+        self.n_ids = 0
+
+    def __len__(self):
+        return self.n_ids
+
+    def lookup(self, digests):
+        """Representative number of each digest (n x 2 uint64), -1 for new digests."""
+        rep_no = np.full(len(digests), -1, dtype=np.int64)
+        for run_hi, run_lo, run_rep_no in self.runs:
+            pos = np.searchsorted(run_hi, digests[:, 0])
+            pos[pos == len(run_hi)] = 0
+            hit = (run_hi[pos] == digests[:, 0]) & (run_lo[pos] == digests[:, 1])
+            rep_no[hit] = run_rep_no[pos[hit]]
+        return rep_no
+
+    def add(self, digests, seq_ids):
+        """Add distinct new digests with the IDs of their representatives, numbered in order."""
+        if len(seq_ids) == 0:
+            return
+        rep_no = np.arange(self.n_ids, self.n_ids + len(seq_ids), dtype=np.int64)
+        while len(self.id_offsets) <= self.n_ids + len(seq_ids):
+            self.id_offsets = np.concatenate(
+                [self.id_offsets, np.zeros(len(self.id_offsets), dtype=np.int64)]
+            )
+        for seq_id in seq_ids:
+            self.id_data += seq_id
+            self.n_ids += 1
+            self.id_offsets[self.n_ids] = len(self.id_data)
+
+        run = (digests[:, 0], digests[:, 1], rep_no)
+        while self.runs and len(self.runs[-1][0]) <= 2 * len(run[0]):
+            run = tuple(np.concatenate(it) for it in zip(self.runs.pop(), run))
+        order = np.argsort(run[0], kind="stable")
+        self.runs.append(tuple(it[order] for it in run))
+
+    def seq_id(self, rep_no):
+        return bytes(self.id_data[self.id_offsets[rep_no] : self.id_offsets[rep_no + 1]])
+
+
+def _collapse_duplicates(records, representatives, dup_map):
+    """
+    Keep the first protein of each distinct sequence, write the others to dup_map.
+
+    Parameters:
+    - records (list): (ID, FASTA record, protein digest) from _translate_block.
+    - representatives (_ProteinRepresentatives): Representatives seen so far, updated.
+    - dup_map (file): Text handle of the duplicate -> representative table.
+
+    Returns:
+    - tuple: (FASTA block of the representatives, number of duplicates)
+    """
+    if not records:
+        return b"", 0
+    digests = np.frombuffer(
+        b"".join(it[2] for it in records), dtype=np.uint64
+    ).reshape(-1, 2)
+    rep_no = representatives.lookup(digests)
+
+    # proteins seen for the first time: the first of each digest in the batch is the
+    # representative, later ones in the batch are its duplicates
+    is_rep = np.zeros(len(records), dtype=bool)
+    batch_rep_no = {}
+    for ii in np.flatnonzero(rep_no < 0).tolist():
+        digest = records[ii][2]
+        cur_rep_no = batch_rep_no.get(digest)
+        if cur_rep_no is None:
+            cur_rep_no = batch_rep_no[digest] = len(representatives) + len(batch_rep_no)
+            is_rep[ii] = True
+        rep_no[ii] = cur_rep_no
+    new_rep_pos = np.flatnonzero(is_rep)
+    representatives.add(
+        digests[new_rep_pos], [records[ii][0] for ii in new_rep_pos.tolist()]
+    )
+
+    block = []
+    dup_lines = []
+    for (seq_id, record, _), cur_is_rep, cur_rep_no in zip(
+        records, is_rep.tolist(), rep_no.tolist()
+    ):
+        if cur_is_rep:
+            block.append(record)
+        else:
+            dup_lines.append(
+                seq_id + b"\t" + representatives.seq_id(cur_rep_no) + b"\n"
+            )
+    dup_map.write(b"".join(dup_lines).decode())
+    return b"".join(block), len(dup_lines)
+
+
+def translate(
+    fna: str,
+    out: str,
+    translation_tables: List[int],
+    threads: int = 1,
+    batch_size: int = BATCH_SIZE,
+    max_inflight: int = None,
+    duplicate_map: str = None,
+):
     """
     Translate a FASTA file with nucleotide sequences to amino acid sequences.
+
+    The input may be plain or gzip compressed, the output is gzip compressed when it
+    ends with .gz. Proteins are written in input order for any number of threads.
+
+    With duplicate_map, identical proteins are written once, under the ID of their
+    first gene, and every other gene is listed with that representative in the
+    duplicate_map TSV (protein_id, representative_id), so that protein clusters can
+    be expanded to all genes again.
     """
-    with open(out, "w") as faa:
-        record: SeqRecord
-        for record in tqdm.tqdm(SeqIO.parse(fna, "fasta")):
-            failed = True
-            for translation_table in translation_tables:
-                try:
-                    translated: SeqRecord = record.translate(
-                        table=translation_table, stop_symbol="", cds=True
-                    )
-                    translated.id = record.id
-                    translated.description = ""
-                    SeqIO.write(translated, faa, "fasta")
-                    failed = False
-                    break
-                except TranslationError:
-                    pass
-
-            if failed:
-                logging.warning(f"Translation failed for {record.id}")
+    max_inflight = max_inflight or 2 * threads
+    tasks = (
+        (batch, translation_tables, duplicate_map is not None)
+        for batch in iter_batches(read_fasta(fna), batch_size)
+    )
+    n_records = 0
+    n_failed = 0
+    n_duplicates = 0
+    representatives = _ProteinRepresentatives()
+    dup_map_handle = (
+        open(duplicate_map, "w") if duplicate_map else contextlib.nullcontext()
+    )
+    with open_fasta_out(out) as faa, tqdm.tqdm(
+        unit=" records"
+    ) as progress, dup_map_handle as dup_map:
+        if dup_map is not None:
+            dup_map.write("protein_id\trepresentative_id\n")
+        # batches are translated in a process pool, at most max_inflight of them are
+        # read, queued or waiting to be written, so memory does not grow with the catalog
+        for block, failed, n_batch in ordered_pool_map(
+            _translate_block, tasks, threads, max_inflight
+        ):
+            for seq_id in failed:
+                logging.warning(f"Translation failed for {seq_id}")
+            if dup_map is not None:
+                block, n_batch_duplicates = _collapse_duplicates(
+                    block, representatives, dup_map
+                )
+                n_duplicates += n_batch_duplicates
+            faa.write(block)
+            n_records += n_batch
+            n_failed += len(failed)
+            progress.update(n_batch)
+    logging.info(f"{n_records - n_failed} of {n_records} sequences translated")
+    if duplicate_map is not None:
+        logging.info(
+            f"{n_duplicates} duplicated proteins collapsed into {len(representatives)} distinct sequences"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Translate nucleotide CDS to proteins, trying the genetic codes in order."
+    )
+    parser.add_argument("input_fp", help="nucleotide FASTA file, plain or gzip")
+    parser.add_argument("sfp", help="protein FASTA file, gzip compressed if it ends with .gz")
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=1,
+        help="number of worker processes [1]",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help=f"records per batch [{BATCH_SIZE}]",
+    )
+    parser.add_argument(
+        "--max-inflight",
+        type=int,
+        default=None,
+        help="batches held in memory at most, read, queued or waiting to be written [2 x threads]",
+    )
+    parser.add_argument(
+        "--tables",
+        type=int,
+        nargs="+",
+        default=DEFAULT_TRANSLATION_TABLES,
+        help="NCBI genetic codes, tried in order [11 4]",
+    )
+    parser.add_argument(
+        "--collapse-duplicates",
+        metavar="MAP",
+        default=None,
+        help="write identical proteins once and the duplicate -> representative IDs to MAP [TSV]; keeps about 24 bytes plus the ID per distinct protein in memory",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    translate(
+        args.input_fp,
+        args.sfp,
+        args.tables,
+        threads=max(args.threads, 1),
+        batch_size=args.batch_size,
+        max_inflight=args.max_inflight,
+        duplicate_map=args.collapse_duplicates,
+    )
 
 
 # usage:
-# python /data/translate_fasta.py ${input_fp} ${output_fp}
+# python /data/translate_fasta.py [--threads N] ${input_fp} ${output_fp}
 
 if __name__ == "__main__":
-    input_fp = sys.argv[1]  # fasta format DNA sequence
-    sfp = sys.argv[2]  # fasta format DNA sequence
-    translate(input_fp, sfp, DEFAULT_TRANSLATION_TABLES)
+    main()
@@ -116,6 +116,7 @@ process COVERM_CONTIG_MERGE {
 
     output:
     tuple val(meta), path("*_merged.tsv"), emit: abundance_merged
+    tuple val(meta), path("*_merged.{npy,rows.txt,samples.txt}"), optional: true, emit: abundance_binary
     path("versions.yml"), emit: versions
 
     when:
@@ -123,9 +124,10 @@ process COVERM_CONTIG_MERGE {
 
     script:
     def prefix = task.ext.prefix ?: "${meta.id}"
+    def args = task.ext.args ?: ''
     """
 
-    coverm_merge.py ${tsv_files} -o ${prefix}_merged.tsv
+    coverm_merge.py ${tsv_files} -o ${prefix}_merged.tsv ${args}
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
@@ -0,0 +1,41 @@
+process BUILD_GENE_CATALOG {
+    tag "$meta.id"
+    label 'process_medium'
+
+    conda "conda-forge::python=3.10 conda-forge::numpy conda-forge::click"
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://github.com/schirmer-lab/singularity-images/releases/download/23.11.27/python_3.10.sif' :
+        'docker.io/raphsoft/python_base:3.10-R4' }"
+
+    input:
+    tuple val(meta), path(prodigal_fastas)
+
+    output:
+    tuple val(meta), path("*.fna.gz"), emit: catalog
+    tuple val(meta), path("*.fna.gz.coords.npz"), emit: coords, optional: true  // gene coordinates in catalog order
+    path "versions.yml", emit: versions
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script:
+    def args = task.ext.args ?: ''
+    def prefix = task.ext.prefix ?: "${meta.id}"
+    // Prodigal outputs are filtered in parallel and written in the given order into one
+    // compressed catalog; the list is written by a shell builtin so thousands of paths
+    // do not hit the argument length limit
+    """
+    printf '%s\\n' ${prodigal_fastas} > prodigal_fastas.txt
+
+    build_gene_catalog.py \\
+        ${prefix}.fna.gz \\
+        --input-list prodigal_fastas.txt \\
+        --threads ${task.cpus} \\
+        ${args}
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //g')
+    END_VERSIONS
+    """
+}
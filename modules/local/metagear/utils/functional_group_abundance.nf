@@ -0,0 +1,43 @@
+process FUNCTIONALGROUP_ABUNDANCE {
+    tag "$meta.id"
+    label 'process_medium'
+
+    conda "conda-forge::python=3.10 conda-forge::pandas conda-forge::numpy conda-forge::click"
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://github.com/schirmer-lab/singularity-images/releases/download/25.08.11/python_3.10.sif':
+        'docker.io/raphsoft/python_base:3.10-R4' }"
+
+    input:
+    tuple val(meta), path(abundance)    // merged gene x sample table, e.g. gene_abundance_rpkm_merged.tsv
+    path(protein_clusters)              // CD-HIT .clstr of the protein catalog
+    path(protein_duplicates)            // duplicate -> representative protein map, *.prot.dup.tsv
+    path(fg_tables)                     // *.FG_IPS_<database>.tsv
+
+    output:
+    tuple val(meta), path("*.FG_*.tsv"), emit: fg_abundance
+    path "versions.yml", emit: versions
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script:
+    def args = task.ext.args ?: ''
+    def prefix = task.ext.prefix ?: "${meta.id}"
+    def fg_args = fg_tables.collect { "--fg-table ${it}" }.join(' ')
+    """
+    functional_group_abundance.py \\
+        --abundance ${abundance} \\
+        --clusters ${protein_clusters} \\
+        --duplicate-map ${protein_duplicates} \\
+        ${fg_args} \\
+        --output-prefix ${prefix} \\
+        ${args}
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //g')
+        numpy: \$(python -c "import numpy; print(numpy.__version__)")
+        pandas: \$(python -c "import pandas; print(pandas.__version__)")
+    END_VERSIONS
+    """
+}
@@ -2,7 +2,7 @@ process MSP_METAPHLAN_ANNOTATION {
     tag "$meta.id"
     label 'process_medium'
 
-    conda "conda-forge::python=3.10 conda-forge::pandas conda-forge::numpy conda-forge::scikit-learn"
+    conda "conda-forge::python=3.10 conda-forge::pandas conda-forge::numpy conda-forge::scipy"
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
         'https://github.com/schirmer-lab/singularity-images/releases/download/25.08.11/python_3.10.sif':
         'docker.io/raphsoft/python_base:3.10-R4' }"
@@ -12,8 +12,10 @@ process MSP_METAPHLAN_ANNOTATION {
     val metaphlan_version
 
     output:
-    tuple val(meta), path("msp_metaphlan*_LM.full.txt"), emit: full_results
-    tuple val(meta), path("msp_metaphlan*_LM.bestR2.txt"), emit: best_results
+    tuple val(meta), path("msp_metaphlan*_LM.bestR2.txt"), optional: true, emit: best_results      // --metric lm (default)
+    tuple val(meta), path("msp_metaphlan*.best.txt"), optional: true, emit: metric_results   // --metric pearson/spearman/log
+    tuple val(meta), path("msp_metaphlan*.top*.txt"), optional: true, emit: top_results       // --top-k > 1
+    tuple val(meta), path("msp_metaphlan*.full.npz"), optional: true, emit: full_results      // --full-table
     path "versions.yml", emit: versions
 
     when:
@@ -22,6 +24,8 @@ process MSP_METAPHLAN_ANNOTATION {
     script:
     def args = task.ext.args ?: ''
     def version = metaphlan_version ?: 'v3'
+    // leave room for the profiles and the results next to the scoring tiles
+    def memory_budget = task.memory ? (task.memory.mega * 0.6).intValue() : 2048
     """
     # Run MSP-MetaPhlAn taxonomic annotation using linear regression
     msp_metaphlan_LM.py \\
@@ -29,6 +33,8 @@ process MSP_METAPHLAN_ANNOTATION {
         --metaphlan-profile ${metaphlan_profile} \\
         --output-dir . \\
         --metaphlan-version ${version} \\
+        --threads ${task.cpus} \\
+        --memory-budget ${memory_budget} \\
         ${args}
 
     cat <<-END_VERSIONS > versions.yml
@@ -36,7 +42,7 @@ process MSP_METAPHLAN_ANNOTATION {
         python: \$(python --version | sed 's/Python //g')
         numpy: \$(python -c "import numpy; print(numpy.__version__)")
         pandas: \$(python -c "import pandas; print(pandas.__version__)")
-        scikit-learn: \$(python -c "import sklearn; print(sklearn.__version__)")
+        scipy: \$(python -c "import scipy; print(scipy.__version__)")
     END_VERSIONS
     """
 }
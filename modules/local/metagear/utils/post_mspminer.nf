@@ -1,14 +1,51 @@
+process MSP_MEMBERSHIP {
+    tag "$meta.id"
+    label 'process_medium'
+
+    conda "conda-forge::python=3.10 conda-forge::pandas conda-forge::click conda-forge::biopython conda-forge::scikit-learn"
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://github.com/schirmer-lab/singularity-images/releases/download/25.08.11/python_3.10.sif':
+        'docker.io/raphsoft/python_base:3.10-R4' }"
+
+    input:
+    tuple val(meta), path(all_msps)
+
+    output:
+    tuple val(meta), path("*.membership.npz"), emit: membership
+    path "versions.yml", emit: versions
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script:
+    def args = task.ext.args ?: ''
+    """
+    # Encode the MSP gene membership once, it is shared by MSP_SEQUENCES and MSP_ABUNDANCE
+    postminer_utils.py helper build-msp-membership \\
+        --all-msps-fp ${all_msps} \\
+        --membership-fp ${all_msps}.membership.npz \\
+        ${args}
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //g')
+        pandas: \$(python -c "import pandas; print(pandas.__version__)")
+        numpy: \$(python -c "import numpy; print(numpy.__version__)")
+    END_VERSIONS
+    """
+}
+
 process MSP_SEQUENCES {
     tag "$meta.id"
     label 'process_medium'
 
-    conda "conda-forge::python=3.10 conda-forge::pandas conda-forge::click conda-forge::pyfaidx conda-forge::scikit-learn"
+    conda "conda-forge::python=3.10 conda-forge::pandas conda-forge::click conda-forge::biopython conda-forge::scikit-learn"
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
         'https://github.com/schirmer-lab/singularity-images/releases/download/25.08.11/python_3.10.sif':
         'docker.io/raphsoft/python_base:3.10-R4' }"
 
     input:
-    tuple val(meta), path(gene_catalog), path(all_msps)
+    tuple val(meta), path(gene_catalog), path(all_msps), path(msp_membership)
 
     output:
     tuple val(meta), path("pangenome_sequences/"), emit: pangenome_dir
@@ -28,6 +65,7 @@ process MSP_SEQUENCES {
     postminer_utils.py helper get-msp-pangenome \\
         --gene-catalog-fp ${gene_catalog} \\
         --all-msps-fp ${all_msps} \\
+        --msp-membership-fp ${msp_membership} \\
         --msp-pangenome-dir pangenome_sequences/ \\
         ${args}
 
@@ -35,7 +73,7 @@ process MSP_SEQUENCES {
     "${task.process}":
         python: \$(python --version | sed 's/Python //g')
         pandas: \$(python -c "import pandas; print(pandas.__version__)")
-        pyfaidx: \$(python -c "import pyfaidx; print(pyfaidx.__version__)")
+        numpy: \$(python -c "import numpy; print(numpy.__version__)")
     END_VERSIONS
     """
 }
@@ -44,17 +82,18 @@ process MSP_ABUNDANCE {
     tag "$meta.id"
     label 'process_medium'
 
-    conda "conda-forge::python=3.10 conda-forge::pandas conda-forge::click conda-forge::pyfaidx conda-forge::scikit-learn"
+    conda "conda-forge::python=3.10 conda-forge::pandas conda-forge::click conda-forge::biopython conda-forge::scikit-learn"
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
         'https://github.com/schirmer-lab/singularity-images/releases/download/25.08.11/python_3.10.sif':
         'docker.io/raphsoft/python_base:3.10-R4' }"
 
     input:
-    tuple val(meta), path(rpkm_file), path(all_msps)
+    tuple val(meta), path(rpkm_files), path(all_msps), path(msp_membership) // rpkm TSV or binary matrix (.npy + sidecars)
     val method
 
     output:
     tuple val(meta), path("msp_abundance.${method}.tsv"), emit: msp_abundance
+    tuple val(meta), path("msp_abundance.${method}.tsv.meta.json"), emit: msp_abundance_meta
     path "versions.yml", emit: versions
 
     when:
@@ -63,20 +102,24 @@ process MSP_ABUNDANCE {
     script:
     def args = task.ext.args ?: ''
     def output_file = "msp_abundance.${method}.tsv"
+    def rpkm_list = [rpkm_files].flatten()
+    def rpkm_file = rpkm_list.find { it.name.endsWith('.npy') } ?: rpkm_list.first()
     """
     # Run the post-MSP mining utility to calculate MSP abundance
     postminer_utils.py helper get-msp-abd \\
         --rpkm-fp ${rpkm_file} \\
         --all-msps-fp ${all_msps} \\
+        --msp-membership-fp ${msp_membership} \\
         --save-fp ${output_file} \\
         --method ${method} \\
+        --threads ${task.cpus} \\
         ${args}
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
         python: \$(python --version | sed 's/Python //g')
         pandas: \$(python -c "import pandas; print(pandas.__version__)")
-        pyfaidx: \$(python -c "import pyfaidx; print(pyfaidx.__version__)")
+        numpy: \$(python -c "import numpy; print(numpy.__version__)")
         scikit-learn: \$(python -c "import sklearn; print(sklearn.__version__)")
     END_VERSIONS
     """
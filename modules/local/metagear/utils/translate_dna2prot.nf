@@ -12,6 +12,7 @@ process TRANSLATE_DNA2PROT {
 
     output:
     tuple val(meta), path("*.prot.faa"), emit: prot_fasta_output
+    tuple val(meta), path("*.prot.dup.tsv"), emit: duplicate_map  // duplicate -> representative protein IDs
     path "versions.yml", emit: versions
 
     when:
@@ -20,13 +21,15 @@ process TRANSLATE_DNA2PROT {
     script:
     def base = input_fp.baseName
     def output_fp = "${base}.prot.faa"
+    def duplicate_map = "${base}.prot.dup.tsv"
     def args = task.ext.args ?: ''
     def prefix = task.ext.prefix ?: "${meta.id}"
 
     """
     echo running translate_fasta $input_fp $output_fp
     # python /nfs/data/work/shen/github/metagear-pipeline-internal/bin/
-    translate_fasta.py $input_fp $output_fp
+    # identical proteins are written once, so CD-HIT and the annotation see each sequence once
+    translate_fasta.py --threads ${task.cpus} --collapse-duplicates $duplicate_map $args $input_fp $output_fp
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
         Python: 3.8
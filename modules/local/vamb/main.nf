@@ -22,23 +22,11 @@ process VAMB_CONCATENATE_FASTA {
     def m = args2 =~ /--catalog_name\s+(\S+)/
     def catalog_name = m.find() ? m.group(1) : ''
 
+    // one call for all assemblies, read and compressed by task.cpus worker processes
     """
+    printf '%s\\n' ${assemblies} > assemblies.txt
 
-    files=($assemblies)
-
-    mkdir tmp_batches
-
-    for ((i=0; i<\${#files[@]}; i+=1000)); do
-        batch_files="\${files[@]:i:1000}"
-        temp_file=./tmp_batches/temp_\${i}.fna.gz
-        concatenate_fasta.py $args \$temp_file \$batch_files
-        temp_files+=(\$temp_file)
-    done
-
-    concatenate_fasta.py $args ${prefix}.${catalog_name}.fna.gz \${temp_files[@]}
-
-    # Remove the temporary files
-    rm -rf tmp_batches
+    concatenate_fasta.py $args --threads ${task.cpus} ${prefix}.${catalog_name}.fna.gz @assemblies.txt
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
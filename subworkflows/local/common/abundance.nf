@@ -56,6 +56,11 @@ workflow ABUNDANCE {
         ch_rpkm  = COVERM_CONTIG_MERGE.out.abundance_merged.filter { it[0].id.endsWith('_rpkm') }
         ch_count = COVERM_CONTIG_MERGE.out.abundance_merged.filter { it[0].id.endsWith('_count') }
 
+        // rpkm for MSP abundance: the binary matrix if --binary-output is in ext.args, the TSV otherwise
+        ch_rpkm_matrix = ch_rpkm
+                            .join( COVERM_CONTIG_MERGE.out.abundance_binary.filter { it[0].id.endsWith('_rpkm') }, remainder: true )
+                            .map { meta, tsv, binary -> [ meta, binary ?: tsv ] }
+
         // summary channel versions
         ch_versions = BWA_INDEX.out.versions
                         .mix(COVERM_MAKE.out.versions)
@@ -66,6 +71,7 @@ workflow ABUNDANCE {
         alignments = COVERM_MAKE.out.alignments
         tpm = ch_tpm
         rpkm = ch_rpkm
+        rpkm_matrix = ch_rpkm_matrix // [ meta, [ .npy, .rows.txt, .samples.txt ] or .tsv ]
         count = ch_count
         versions = ch_versions
 }
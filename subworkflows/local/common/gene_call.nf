@@ -4,9 +4,7 @@ include { INPUT_CHECK } from "$projectDir/subworkflows/local/common/input_check"
 
 include { MEGAHIT } from "$projectDir/modules/local/megahit/main"
 include { PRODIGAL } from "$projectDir/modules/nf-core/prodigal"
-include { FILTER_PRODIGAL } from "$projectDir/modules/local/metagear/utils/filter_prodigal"
-
-include { VAMB_CONCATENATE_FASTA } from "$projectDir/modules/local/vamb/main"
+include { BUILD_GENE_CATALOG } from "$projectDir/modules/local/metagear/utils/build_gene_catalog"
 
 include { CDHIT_CDHITEST } from "$projectDir/modules/local/cdhit/cdhitest/main"
 
@@ -38,27 +36,26 @@ workflow GENE_CALL {
 
         PRODIGAL ( MEGAHIT.out.contigs, "gff" )
 
-        FILTER_PRODIGAL ( PRODIGAL.out.nucleotide_fasta )
-
-        ch_merged_genes = FILTER_PRODIGAL.out.filtered_fasta.map{ it -> it[1] }
-                .collect()
-                .map{ it -> [ [id: "genes"], it ] }
+        // filter the gene calls of all samples into one catalog, ordered by sample id
+        ch_prodigal_genes = PRODIGAL.out.nucleotide_fasta
+                .toSortedList { a, b -> a[0].id <=> b[0].id }
+                .map{ it -> [ [id: "genes"], it.collect{ sample -> sample[1] } ] }
 
-        VAMB_CONCATENATE_FASTA ( ch_merged_genes )
+        BUILD_GENE_CATALOG ( ch_prodigal_genes )
 
-        ch_input_catalog = VAMB_CONCATENATE_FASTA.out.catalog.map { it -> tuple([id: "gene_catalog"], it[1]) }
+        ch_input_catalog = BUILD_GENE_CATALOG.out.catalog.map { it -> tuple([id: "gene_catalog"], it[1]) }
 
         CDHIT_CDHITEST ( ch_input_catalog )
 
         ch_versions = MEGAHIT.out.versions.first()
                         .mix(PRODIGAL.out.versions.first())
-                        .mix(FILTER_PRODIGAL.out.versions.first())
-                        .mix(VAMB_CONCATENATE_FASTA.out.versions)
+                        .mix(BUILD_GENE_CATALOG.out.versions)
                         .mix(CDHIT_CDHITEST.out.versions)
 
 
     emit:
         contigs = MEGAHIT.out.contigs
         gene_catalog = CDHIT_CDHITEST.out.fasta
+        gene_coords = BUILD_GENE_CATALOG.out.coords  // coordinates of the genes before CD-HIT-EST, by catalog position
         versions = ch_versions
 }
@@ -54,5 +54,6 @@ workflow PROTEIN_ANNOTATION {
 
     emit:
         hits_channel = INTERPROSCAN.out.tsv
+        fg_annotations = FUNCTIONALGROUP_ANNOTATION.out.fg_ann_fp // [ *.FG_IPS_<database>.tsv ]
         versions = ch_versions
 }
@@ -40,5 +40,6 @@ workflow PROTEIN_CALL {
     emit:
         protein_catalog = CDHIT_CDHIT.out.fasta
         protein_catalog_clusters = CDHIT_CDHIT.out.clusters
+        protein_duplicates = TRANSLATE_DNA2PROT.out.duplicate_map // genes collapsed into an identical protein before CD-HIT
         versions = ch_versions
 }
@@ -9,6 +9,8 @@ include { PROTEIN_ANNOTATION } from "$projectDir/subworkflows/local/common/prote
 
 include { MSP } from "$projectDir/subworkflows/local/pangenome/msp"
 
+include { FUNCTIONALGROUP_ABUNDANCE } from "$projectDir/modules/local/metagear/utils/functional_group_abundance"
+
 workflow GENE_ANALYSIS_INIT {
 
     main:
@@ -52,7 +54,15 @@ workflow GENE_ANALYSIS {
 
         PROTEIN_ANNOTATION ( PROTEIN_CALL.out.protein_catalog )
 
-        MSP ( GENE_CALL.out.gene_catalog, GENE_ABUNDANCE.out.count, GENE_ABUNDANCE.out.rpkm, gtdb_tk_db, metaphlan_profiles )
+        // FG x sample tables: genes -> CD-HIT protein clusters -> FG of the representative
+        FUNCTIONALGROUP_ABUNDANCE (
+            GENE_ABUNDANCE.out.count.mix(GENE_ABUNDANCE.out.rpkm),
+            PROTEIN_CALL.out.protein_catalog_clusters.map { it[1] }.first(),
+            PROTEIN_CALL.out.protein_duplicates.map { it[1] }.first(),
+            PROTEIN_ANNOTATION.out.fg_annotations.flatten().collect()
+        )
+
+        MSP ( GENE_CALL.out.gene_catalog, GENE_ABUNDANCE.out.count, GENE_ABUNDANCE.out.rpkm_matrix, gtdb_tk_db, metaphlan_profiles )
 
         // summary channel version
         ch_versions = GENE_CALL.out.versions
@@ -60,6 +70,7 @@ workflow GENE_ANALYSIS {
                         .mix(GENE_ABUNDANCE.out.versions)
                         .mix(MSP.out.versions)
                         .mix(PROTEIN_ANNOTATION.out.versions)
+                        .mix(FUNCTIONALGROUP_ABUNDANCE.out.versions.first())
 
 
     emit:
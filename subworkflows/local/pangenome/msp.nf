@@ -1,5 +1,5 @@
 include { MSPMINER_MSPMINER } from "$projectDir/modules/local/mspminer"
-include { MSP_SEQUENCES; MSP_ABUNDANCE } from "$projectDir/modules/local/metagear/utils/post_mspminer"
+include { MSP_MEMBERSHIP; MSP_SEQUENCES; MSP_ABUNDANCE } from "$projectDir/modules/local/metagear/utils/post_mspminer"
 
 include { GTDBTK_CLASSIFYWF } from "$projectDir/modules/local/gtdbtk/classifywf"
 include { MSP_METAPHLAN_ANNOTATION } from "$projectDir/modules/local/metagear/utils/msp_metaphlan_annotation"
@@ -20,12 +20,17 @@ workflow MSP {
 
         ch_gene_catalog = gene_catalog.map { [ [id: "pangenome"], it[1] ] }
         ch_mspminer_table = MSPMINER_MSPMINER.out.mspminer_main_table.map { [ [id: "pangenome"], it[1] ] }
-        ch_post_mspminer = ch_gene_catalog.join(ch_mspminer_table)
+
+        // all_msps.tsv is encoded once and the membership passed to both post-MSPminer steps
+        MSP_MEMBERSHIP ( ch_mspminer_table )
+        ch_msp_membership = ch_mspminer_table.join(MSP_MEMBERSHIP.out.membership)
+
+        ch_post_mspminer = ch_gene_catalog.join(ch_msp_membership)
 
         MSP_SEQUENCES ( ch_post_mspminer )
 
         ch_gene_rpkm = gene_abundance_rpkm.map { [ [id: "pangenome"], it[1] ] }
-        ch_msp_abundance = ch_gene_rpkm.join(ch_mspminer_table)
+        ch_msp_abundance = ch_gene_rpkm.join(ch_msp_membership)
 
         MSP_ABUNDANCE ( ch_msp_abundance, "median" )
 
@@ -34,6 +39,7 @@ workflow MSP {
         MSP_METAPHLAN_ANNOTATION ( MSP_ABUNDANCE.out.msp_abundance.combine( metaphlan_profiles ), "v4" )
 
         ch_versions = MSPMINER_MSPMINER.out.versions
+                        .mix(MSP_MEMBERSHIP.out.versions)
                         .mix(MSP_SEQUENCES.out.versions)
                         .mix(MSP_ABUNDANCE.out.versions)
 